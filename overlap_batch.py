@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# mayapy overlap_batch.py scene1.ma scene2.mb ... --output report.json
+# シーンファイルをプロセスプールで並列に開いて衝突判定を行い、結果をJSONで出力する
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from overlap_cache import mesh_signature
+from overlap_engine import CONTAINMENT_METHODS, DEFAULT_CLEARANCE, OverlapEngine, SEARCH_MODES
+from overlap_geometry import MeshArrays, sample_frame_points
+from overlap_instance import InstancedMesh, matrix_from_mmatrix
+
+# 終了コード
+EXIT_CLEAN = 0
+EXIT_OVERLAP = 1
+EXIT_ERROR = 2
+
+
+# ワーカープロセスごとにMayaをスタンドアロンで初期化
+def initialize_maya():
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+
+
+# シーンを開いてメッシュの頂点配列と MFnMesh を取得
+# 頂点配列はシェイプごとにオブジェクト空間で一度だけ取得し、インスタンスや複製されたメッシュで共有する
+def load_scene_meshes(scene_path):
+    import maya.cmds as cmds
+    from maya.api import OpenMaya as om2
+    cmds.file(scene_path, open=True, force=True)
+    meshes, item_mesh_fns = [], []
+    # シェイプのノード -> 頂点配列、ハッシュ値 -> 頂点配列
+    shape_meshes, signature_meshes = {}, {}
+    for shape in cmds.ls(type="mesh", noIntermediate=True, long=True, allPaths=True) or []:
+        selection_list = om2.MSelectionList()
+        selection_list.add(shape)
+        dag_path = selection_list.getDagPath(0)
+        item_mesh_fn = om2.MFnMesh(dag_path)
+        shape_id = om2.MObjectHandle(dag_path.node()).hashCode()
+        mesh = shape_meshes.get(shape_id)
+        if mesh is None:
+            mesh = MeshArrays.from_mesh_fn(item_mesh_fn, om2.MSpace.kObject)
+            mesh = signature_meshes.setdefault(mesh_signature(mesh), mesh)
+            shape_meshes[shape_id] = mesh
+        matrix = matrix_from_mmatrix(dag_path.inclusiveMatrix())
+        meshes.append(InstancedMesh(mesh, matrix, dag_path.fullPathName()))
+        item_mesh_fns.append(item_mesh_fn)
+    return meshes, item_mesh_fns
+
+
+# 1つのシーンファイルの衝突判定を行い、レポート用の辞書を返す
+# frames を指定した場合はそのフレーム範囲を判定する
+def scan_scene(scene_path, mode, containment="Ray Parity", voxel_size=None, clearance=DEFAULT_CLEARANCE,
+               frames=None):
+    start = time.time()
+    report = {"scene": scene_path, "status": "ok"}
+    try:
+        meshes, item_mesh_fns = load_scene_meshes(scene_path)
+        engine = OverlapEngine(mode, containment=containment, voxel_size=voxel_size, clearance=clearance)
+        if frames:
+            frame_points = sample_frame_points(item_mesh_fns, range(frames[0], frames[1] + 1))
+            result = engine.scan_frames(meshes, frame_points)
+        else:
+            result = engine.search(meshes)
+        report.update(result.to_dict())
+        report["has_overlap"] = result.has_overlap
+    except Exception as e:
+        report["status"] = "error"
+        report["error"] = str(e)
+    report["elapsed"] = time.time() - start
+    return report
+
+
+# シーンファイルのリストを取得 (--scene-list のファイルは1行に1パス)
+def collect_scenes(scenes, scene_list=None):
+    scenes = list(scenes)
+    if scene_list:
+        with open(scene_list) as f:
+            scenes.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return scenes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Search overlapping meshes in Maya scene files.")
+    parser.add_argument("scenes", nargs="*", help="Maya scene files to check")
+    parser.add_argument("--scene-list", help="text file with one scene path per line")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="Exact", help="search mode (default: Exact)")
+    parser.add_argument("--containment", choices=CONTAINMENT_METHODS, default="Ray Parity",
+                        help="inside test used by the Sample mode (default: Ray Parity)")
+    parser.add_argument("--voxel-size", type=float, help="voxel edge length for the Voxel mode (default: auto)")
+    parser.add_argument("--clearance", type=float, default=DEFAULT_CLEARANCE,
+                        help=f"distance for the Clearance mode (default: {DEFAULT_CLEARANCE})")
+    parser.add_argument("--frames", type=int, nargs=2, metavar=("START", "END"),
+                        help="check every frame in this range and add a per-frame timeline to the report")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--output", help="JSON report path (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenes = collect_scenes(args.scenes, args.scene_list)
+    if not scenes:
+        print("No scene files given.", file=sys.stderr)
+        return EXIT_ERROR
+
+    # 入力の順にレポートを並べる (完了順に埋める)
+    reports = [None] * len(scenes)
+    done = 0
+    if args.workers <= 1:
+        initialize_maya()
+        for index, scene_path in enumerate(scenes):
+            reports[index] = scan_scene(
+                scene_path, args.mode, args.containment, args.voxel_size, args.clearance, args.frames)
+            done += 1
+            print(f"[{done}/{len(scenes)}] {scene_path}: {reports[index]['status']}", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=initialize_maya) as executor:
+            # future -> (入力での番号, シーンのパス)
+            futures = {
+                executor.submit(
+                    scan_scene, scene_path, args.mode, args.containment, args.voxel_size, args.clearance, args.frames):
+                    (index, scene_path)
+                for index, scene_path in enumerate(scenes)
+            }
+            # ワーカーが落ちた場合 (BrokenProcessPool など) もそのシーンをエラーとして記録し、残りのレポートを出力する
+            for future in as_completed(futures):
+                index, scene_path = futures[future]
+                try:
+                    reports[index] = future.result()
+                except Exception as e:
+                    reports[index] = {"scene": scene_path, "status": "error", "error": f"{type(e).__name__}: {e}"}
+                done += 1
+                print(f"[{done}/{len(scenes)}] {scene_path}: {reports[index]['status']}", file=sys.stderr)
+
+    summary = {
+        "scenes": len(reports),
+        "with_overlap": sum(1 for report in reports if report.get("has_overlap")),
+        "errors": sum(1 for report in reports if report["status"] == "error"),
+    }
+    output = json.dumps({"summary": summary, "files": reports}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if summary["errors"]:
+        return EXIT_ERROR
+    if summary["with_overlap"]:
+        return EXIT_OVERLAP
+    return EXIT_CLEAN
+
+
+# 想定外の例外で終了コード1 (EXIT_OVERLAP と同じ) にならないよう、EXIT_ERROR で終了する
+def run(argv=None):
+    try:
+        return main(argv)
+    except Exception:
+        traceback.print_exc()
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+# python overlap_benchmark.py --scene spheres --sizes 16 32 64
+# Mayaなしで合成メッシュを使い、各段階の処理時間とピークメモリを計測する
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from overlap_bvh import triangulate_faces
+from overlap_engine import OverlapEngine
+from overlap_geometry import MeshArrays
+from overlap_instance import InstancedMesh
+
+# MSpace.kWorld の代わり
+WORLD_SPACE = "kWorld"
+SCENES = ("spheres", "tori", "cubes", "many", "instances")
+
+
+# MBoundingBox の代わり
+class FakeBoundingBox(object):
+
+    def __init__(self, bounds_min, bounds_max):
+        self.min = tuple(bounds_min)
+        self.max = tuple(bounds_max)
+
+
+# numpy配列で動く MFnMesh の代わり (ワールド空間とオブジェクト空間は区別しない)
+class FakeMeshFn(object):
+
+    def __init__(self, points, face_counts, face_connects, name="fakeMesh"):
+        self.mesh = MeshArrays(points, face_counts, face_connects, name=name)
+        self._name = name
+        triangles, self._tri_faces = triangulate_faces(face_counts, face_connects)
+        corners = self.mesh.points[triangles]
+        self._v0 = corners[:, 0]
+        self._e1 = corners[:, 1] - corners[:, 0]
+        self._e2 = corners[:, 2] - corners[:, 0]
+
+    def name(self):
+        return self._name
+
+    @property
+    def numPolygons(self):
+        return self.mesh.num_faces
+
+    @property
+    def boundingBox(self):
+        return FakeBoundingBox(*self.mesh.bounds)
+
+    def getPoints(self, space=WORLD_SPACE):
+        return [(x, y, z, 1.0) for x, y, z in self.mesh.points.tolist()]
+
+    def getVertices(self):
+        return self.mesh.face_counts.tolist(), self.mesh.face_connects.tolist()
+
+    def getPolygonVertices(self, face_index):
+        return self.mesh.face_vertices(face_index).tolist()
+
+    def getPolygonNormal(self, face_index, space=WORLD_SPACE):
+        return tuple(self.mesh.face_normals()[face_index])
+
+    # 高速化構造を使わずに全三角形と交差判定する (allIntersections と同じ戻り値の並び)
+    def allIntersections(self, raySource, rayDirection, space, maxParam, testBothDirections, *args, **kwargs):
+        origin = np.asarray(tuple(raySource)[:3], dtype=np.float64)
+        direction = np.asarray(tuple(rayDirection)[:3], dtype=np.float64)
+        pvec = np.cross(direction, self._e2)
+        det = np.einsum('ij,ij->i', self._e1, pvec)
+        valid = np.abs(det) > 1e-12
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = np.where(valid, 1.0 / np.where(valid, det, 1.0), 0.0)
+            tvec = origin - self._v0
+            u = np.einsum('ij,ij->i', tvec, pvec) * inv_det
+            qvec = np.cross(tvec, self._e1)
+            v = np.einsum('ij,ij->i', np.broadcast_to(direction, qvec.shape), qvec) * inv_det
+            t = np.einsum('ij,ij->i', self._e2, qvec) * inv_det
+        hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (np.abs(t) <= maxParam)
+        if not testBothDirections:
+            hit &= t > 0
+        tris = np.nonzero(hit)[0]
+        hit_points = [tuple(origin + direction * param) + (1.0,) for param in t[tris]]
+        return (hit_points, t[tris].tolist(), self._tri_faces[tris].tolist(), tris.tolist(),
+                u[tris].tolist(), v[tris].tolist())
+
+
+# 頂点が重複しないように座標を丸めてまとめる
+def weld_points(points, face_connects, decimals=9):
+    _, unique_index, inverse = np.unique(
+        np.round(points, decimals), axis=0, return_index=True, return_inverse=True)
+    return points[unique_index], inverse.ravel()[face_connects]
+
+
+# UV球 (上下は三角形、それ以外は四角形)
+def make_sphere(segments, radius=1.0, center=(0, 0, 0)):
+    rings = max(segments // 2, 2)
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    ring_points = np.stack([
+        np.outer(np.sin(theta), np.cos(phi)).ravel(),
+        np.outer(np.sin(theta), np.sin(phi)).ravel(),
+        np.repeat(np.cos(theta), segments),
+    ], axis=1)
+    points = np.concatenate([[(0, 0, 1)], ring_points, [(0, 0, -1)]]) * radius + center
+    bottom = len(points) - 1
+    counts, connects = [], []
+    for j in range(segments):
+        counts.append(3)
+        connects += [0, 1 + j, 1 + (j + 1) % segments]
+    for i in range(rings - 2):
+        for j in range(segments):
+            a = 1 + i * segments + j
+            b = 1 + i * segments + (j + 1) % segments
+            counts.append(4)
+            connects += [a, a + segments, b + segments, b]
+    last_ring = 1 + (rings - 2) * segments
+    for j in range(segments):
+        counts.append(3)
+        connects += [last_ring + j, bottom, last_ring + (j + 1) % segments]
+    return points, np.array(counts), np.array(connects)
+
+
+# トーラス
+def make_torus(segments, major_radius=1.0, minor_radius=0.3, center=(0, 0, 0), axis=2):
+    minor_segments = max(segments // 2, 3)
+    u = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    v = np.linspace(0, 2 * np.pi, minor_segments, endpoint=False)
+    uu, vv = np.meshgrid(u, v, indexing='ij')
+    ring = major_radius + minor_radius * np.cos(vv)
+    points = np.stack([ring * np.cos(uu), ring * np.sin(uu), minor_radius * np.sin(vv)], axis=-1).reshape(-1, 3)
+    # 軸を入れ替えて向きを変える
+    points = np.roll(points, axis - 2, axis=1) + center
+    i, j = np.meshgrid(np.arange(segments), np.arange(minor_segments), indexing='ij')
+    i1 = (i + 1) % segments
+    j1 = (j + 1) % minor_segments
+    quads = np.stack([
+        i * minor_segments + j, i * minor_segments + j1, i1 * minor_segments + j1, i1 * minor_segments + j,
+    ], axis=-1).reshape(-1, 4)
+    return points, np.full(len(quads), 4), quads.ravel()
+
+
+# 各面を分割した立方体
+def make_cube(divisions, size=1.0, center=(0, 0, 0)):
+    grid = np.linspace(-0.5, 0.5, divisions + 1)
+    a, b = np.meshgrid(grid, grid, indexing='ij')
+    a, b = a.ravel(), b.ravel()
+    i, j = np.meshgrid(np.arange(divisions), np.arange(divisions), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    row = divisions + 1
+    quads = np.stack([i * row + j, (i + 1) * row + j, (i + 1) * row + j + 1, i * row + j + 1], axis=1)
+    points, connects = [], []
+    for axis in range(3):
+        for sign in (-0.5, 0.5):
+            face_points = np.zeros((len(a), 3))
+            face_points[:, axis] = sign
+            face_points[:, (axis + 1) % 3] = a
+            face_points[:, (axis + 2) % 3] = b
+            face_quads = quads if sign > 0 else quads[:, ::-1]
+            connects.append(face_quads + sum(len(p) for p in points))
+            points.append(face_points)
+    points, connects = weld_points(np.concatenate(points), np.concatenate(connects).ravel())
+    return points * size + center, np.full(len(connects) // 4, 4), connects
+
+
+# 少しずつ重なるように格子状に並べた複数のメッシュ
+def make_many(count, segments=12, seed=0):
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(count ** (1.0 / 3.0)))
+    meshes = []
+    for index in range(count):
+        cell = np.array([index % side, (index // side) % side, index // (side * side)], dtype=np.float64)
+        center = cell * 1.8 + rng.uniform(-0.2, 0.2, 3)
+        if index % 2:
+            meshes.append(make_sphere(segments, 1.0, center))
+        else:
+            meshes.append(make_cube(max(segments // 4, 1), 1.6, center))
+    return meshes
+
+
+# 同じ岩のメッシュを回転・拡大縮小して少しずつ重なるように並べたインスタンス
+# (オブジェクト空間のメッシュ, インスタンスごとのワールド行列のリスト) を返す
+def make_instances(count, segments=24, seed=0):
+    rng = np.random.default_rng(seed)
+    points, face_counts, face_connects = make_sphere(segments)
+    points = points * rng.uniform(0.85, 1.15, (len(points), 1))
+    side = int(np.ceil(count ** (1.0 / 3.0)))
+    matrices = []
+    for index in range(count):
+        cell = np.array([index % side, (index // side) % side, index // (side * side)], dtype=np.float64)
+        rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        matrix = np.identity(4)
+        matrix[:3, :3] = rotation * rng.uniform(0.9, 1.1)
+        matrix[3, :3] = cell * 1.8 + rng.uniform(-0.2, 0.2, 3)
+        matrices.append(matrix)
+    return (points, face_counts, face_connects), matrices
+
+
+# シーン名とサイズから MFnMesh の代わりのリストを作成
+def make_scene(scene, size):
+    if scene == "spheres":
+        meshes = [make_sphere(size), make_sphere(size, 1.0, (1.2, 0.2, 0.0))]
+    elif scene == "tori":
+        meshes = [make_torus(size), make_torus(size, center=(0.5, 0, 0), axis=1)]
+    elif scene == "cubes":
+        meshes = [make_cube(size), make_cube(size, 1.0, (0.6, 0.3, 0.2))]
+    elif scene == "many":
+        meshes = make_many(size)
+    elif scene == "instances":
+        # インスタンスを使わずにワールド空間へ複製した場合
+        (points, face_counts, face_connects), matrices = make_instances(size)
+        meshes = [(np.dot(points, matrix[:3, :3]) + matrix[3, :3], face_counts, face_connects)
+                  for matrix in matrices]
+    else:
+        raise ValueError(f"Unknown scene: {scene}")
+    return [FakeMeshFn(*mesh, name=f"{scene}{index}") for index, mesh in enumerate(meshes)]
+
+
+# 処理時間とピークメモリを段階ごとに記録
+class StageTimer(object):
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def measure(self, stage):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stages.append((stage, elapsed, peak))
+
+
+# もともとの実装と同じく、フェースごとに allIntersections を呼んでサンプルポイントを生成
+def legacy_generate_sample_points(mesh_fns):
+    inside_point = []
+    for i in range(len(mesh_fns)):
+        for j in range(i + 1, len(mesh_fns)):
+            for mesh_fn, other_fn in ((mesh_fns[i], mesh_fns[j]), (mesh_fns[j], mesh_fns[i])):
+                points = mesh_fn.getPoints(WORLD_SPACE)
+                for face_index in range(mesh_fn.numPolygons):
+                    face_vertices = mesh_fn.getPolygonVertices(face_index)
+                    center = np.mean([points[vertex][:3] for vertex in face_vertices], axis=0)
+                    normal = np.asarray(mesh_fn.getPolygonNormal(face_index, WORLD_SPACE))
+                    hits = other_fn.allIntersections(center + 0.001 * normal, -normal, WORLD_SPACE, 99999, False)
+                    if len(hits[0]) % 2 != 0:
+                        face_center = tuple(center)
+                        if face_center not in inside_point:
+                            inside_point.append(face_center)
+    sample_points = []
+    for _ in range(len(inside_point) // 2):
+        point1, point2 = random.sample(inside_point, 2)
+        sample_points.append((np.asarray(point1) + np.asarray(point2)) / 2)
+    return sample_points
+
+
+# もともとの実装と同じく、サンプルポイントごとに6方向の allIntersections を呼ぶ
+def legacy_sample_point_ray_cast(mesh_fn, sample_points):
+    directions = [(0, -1, 0), (0, 1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, -1), (0, 0, 1)]
+    highlighted_faces = set()
+    for sample_point in sample_points:
+        for direction in directions:
+            hits = mesh_fn.allIntersections(sample_point, direction, WORLD_SPACE, 99999, False)
+            if hits[2]:
+                highlighted_faces.add(hits[2][0])
+    return highlighted_faces
+
+
+# 1つのシーンで各段階を計測
+def run_benchmark(mesh_fns, legacy=True):
+    timer = StageTimer()
+    engine = OverlapEngine(seed=0)
+    if legacy:
+        with timer.measure("legacy generate_sample_points"):
+            sample_points = legacy_generate_sample_points(mesh_fns)
+        with timer.measure("legacy sample_point_ray_cast"):
+            for mesh_fn in mesh_fns:
+                legacy_sample_point_ray_cast(mesh_fn, sample_points)
+    with timer.measure("extraction"):
+        meshes = [MeshArrays.from_mesh_fn(mesh_fn, WORLD_SPACE) for mesh_fn in mesh_fns]
+    with timer.measure("bvh build"):
+        bvhs = [engine.build_mesh_bvh(mesh) for mesh in meshes]
+    with timer.measure("broad phase"):
+        candidate_pairs = engine.get_candidate_pairs(bvhs)
+    with timer.measure("generate_sample_points"):
+        sample_points = engine.generate_sample_points(meshes, bvhs, candidate_pairs)
+    with timer.measure("sample_point_ray_cast"):
+        for bvh in bvhs:
+            engine.sample_point_ray_cast(bvh, sample_points)
+    with timer.measure("generate_sample_points (winding)"):
+        engine.generate_sample_points(meshes, bvhs, candidate_pairs, containment="Winding Number")
+    with timer.measure("exact narrow phase"):
+        engine.search(meshes, bvhs, mode="Exact")
+    with timer.measure("voxel search"):
+        engine.search(meshes, bvhs, mode="Voxel")
+    with timer.measure("self intersection"):
+        engine.search(meshes, bvhs, mode="Self")
+    with timer.measure("clearance"):
+        engine.search(meshes, bvhs, mode="Clearance")
+    # 代理メッシュとBVHの作成を含めて計測する
+    with timer.measure("progressive (with builds)"):
+        engine.search(meshes, mode="Progressive")
+    return timer.stages
+
+
+# インスタンスのシーンで、オブジェクト空間の頂点配列とBVHを共有した場合を計測
+def run_instance_benchmark(size):
+    timer = StageTimer()
+    engine = OverlapEngine(seed=0)
+    mesh, matrices = make_instances(size)
+    mesh_fn = FakeMeshFn(*mesh, name="rock")
+    with timer.measure("instanced extraction"):
+        shared = MeshArrays.from_mesh_fn(mesh_fn, WORLD_SPACE)
+        meshes = [InstancedMesh(shared, matrix, f"rock{index}") for index, matrix in enumerate(matrices)]
+    with timer.measure("instanced bvh build"):
+        bvhs = engine.build_missing_bvhs(meshes)
+    with timer.measure("instanced exact narrow phase"):
+        engine.search(meshes, bvhs, mode="Exact")
+    with timer.measure("instanced clearance"):
+        engine.search(meshes, bvhs, mode="Clearance")
+    return timer.stages
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark overlap search stages on synthetic meshes.")
+    parser.add_argument("--scene", choices=SCENES, default="spheres")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 32, 64],
+                        help="resolution per mesh (object count for the 'many' and 'instances' scenes)")
+    parser.add_argument("--legacy-max-faces", type=int, default=4000,
+                        help="skip the legacy pipeline above this total face count")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for size in args.sizes:
+        mesh_fns = make_scene(args.scene, size)
+        num_faces = sum(mesh_fn.numPolygons for mesh_fn in mesh_fns)
+        legacy = num_faces <= args.legacy_max_faces
+        print(f"== {args.scene} size={size} meshes={len(mesh_fns)} faces={num_faces}")
+        stages = run_benchmark(mesh_fns, legacy)
+        if args.scene == "instances":
+            stages.extend(run_instance_benchmark(size))
+        for stage, elapsed, peak in stages:
+            print(f"{stage:<32} {elapsed:10.4f} s {peak / (1024 * 1024):10.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
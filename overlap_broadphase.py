@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+
+# ワールド空間のバウンディングボックス同士が重なる組だけを Sweep and Prune で抽出
+# 戻り値は (候補ペアの配列 (K, 2), 除外したペア数)
+def sweep_and_prune(bounds_min, bounds_max, tolerance=0.0):
+    bounds_min = np.asarray(bounds_min, dtype=np.float64).reshape(-1, 3) - tolerance
+    bounds_max = np.asarray(bounds_max, dtype=np.float64).reshape(-1, 3) + tolerance
+    num_boxes = len(bounds_min)
+    total_pairs = num_boxes * (num_boxes - 1) // 2
+    if num_boxes < 2:
+        return np.zeros((0, 2), dtype=np.int64), total_pairs
+
+    # X軸の最小値でソートし、区間が重なる範囲だけを候補にする
+    order = np.argsort(bounds_min[:, 0], kind='stable')
+    sorted_min_x = bounds_min[order, 0]
+    sorted_max_x = bounds_max[order, 0]
+    ends = np.searchsorted(sorted_min_x, sorted_max_x, side='right')
+    counts = np.maximum(ends - np.arange(num_boxes) - 1, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros((0, 2), dtype=np.int64), total_pairs
+    first = np.repeat(np.arange(num_boxes), counts)
+    second = first + 1 + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    first = order[first]
+    second = order[second]
+
+    # 残りの軸で重なりを確認
+    overlap = np.all(
+        (bounds_min[first] <= bounds_max[second]) & (bounds_min[second] <= bounds_max[first]),
+        axis=1,
+    )
+    pairs = np.stack([np.minimum(first, second), np.maximum(first, second)], axis=1)[overlap]
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return pairs, total_pairs - len(pairs)
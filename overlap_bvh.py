@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+# レイと三角形の交差判定で使う許容誤差
+INTERSECT_EPSILON = 1e-12
+# 一度に走査するレイの本数
+RAY_CHUNK_SIZE = 1 << 15
+# 一般化巻き数で遠方近似を使う距離 (ノードの半径に対する倍率)
+WINDING_ACCURACY = 2.0
+
+
+# 多角形をファン分割して三角形の頂点インデックスと元のフェース番号を返す
+def triangulate_faces(face_counts, face_connects):
+    face_counts = np.asarray(face_counts, dtype=np.int64)
+    face_connects = np.asarray(face_connects, dtype=np.int64)
+    tri_counts = np.maximum(face_counts - 2, 0)
+    num_tris = int(tri_counts.sum())
+    if num_tris == 0:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    face_offsets = np.cumsum(face_counts) - face_counts
+    tri_faces = np.repeat(np.arange(len(face_counts)), tri_counts)
+    # フェース内で何番目の三角形かを求める
+    tri_local = np.arange(num_tris) - np.repeat(np.cumsum(tri_counts) - tri_counts, tri_counts)
+    base = face_offsets[tri_faces]
+    triangles = np.stack([
+        face_connects[base],
+        face_connects[base + tri_local + 1],
+        face_connects[base + tri_local + 2],
+    ], axis=1)
+    return triangles, tri_faces
+
+
+# 点 (N, 3) を4x4行列 (Mayaと同じ行ベクトルの規約) で変換
+def transform_points(points, matrix):
+    return np.dot(points, matrix[:3, :3]) + matrix[3, :3]
+
+
+# バウンディングボックス (N, 3) を変換し、それを囲む軸平行なボックスを返す
+def transform_bounds(bounds_min, bounds_max, matrix):
+    center = transform_points((bounds_min + bounds_max) * 0.5, matrix)
+    extent = np.dot((bounds_max - bounds_min) * 0.5, np.abs(matrix[:3, :3]))
+    return center - extent, center + extent
+
+
+# メッシュ単位のバウンディングボリューム階層
+class MeshBVH(object):
+
+    def __init__(self, points, triangles, tri_faces=None, leaf_size=8):
+        points = np.asarray(points, dtype=np.float64)[:, :3]
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        if tri_faces is None:
+            tri_faces = np.arange(len(triangles))
+        tri_faces = np.asarray(tri_faces, dtype=np.int64)
+        self.points = points
+        self.leaf_size = max(int(leaf_size), 1)
+        order = self._build(points, triangles)
+        # 三角形をBVHの葉の並び順に並べ替えておく
+        self.triangles = triangles[order]
+        self.tri_faces = tri_faces[order]
+        self._update_triangles()
+
+    # 頂点座標から三角形ごとのバウンディングボックスと辺ベクトルを求める
+    def _update_triangles(self):
+        corners = self.points[self.triangles]
+        self._tri_min = corners.min(axis=1)
+        self._tri_max = corners.max(axis=1)
+        self._v0 = corners[:, 0]
+        self._e1 = corners[:, 1] - corners[:, 0]
+        self._e2 = corners[:, 2] - corners[:, 0]
+        # 一般化巻き数の遠方近似に使うノードごとの双極子 (初回の判定時に作成)
+        self._node_dipole = None
+        self._node_center = None
+        self._node_radius = None
+
+    # フェース頂点数と頂点リストからBVHを作成
+    @classmethod
+    def from_polygons(cls, points, face_counts, face_connects, leaf_size=8):
+        triangles, tri_faces = triangulate_faces(face_counts, face_connects)
+        return cls(points, triangles, tri_faces, leaf_size=leaf_size)
+
+    @property
+    def num_triangles(self):
+        return len(self.triangles)
+
+    # ルートノードのバウンディングボックス (min, max)
+    @property
+    def bounds(self):
+        if not len(self._node_min):
+            return np.zeros(3), np.zeros(3)
+        return self._node_min[0].copy(), self._node_max[0].copy()
+
+    # BVH内の三角形番号に対応する頂点座標 (K, 3, 3)
+    def triangle_corners(self, tris):
+        return self.points[self.triangles[tris]]
+
+    # 階層ごとに重心の中央値で分割してノードを作成
+    def _build(self, points, triangles):
+        num_tris = len(triangles)
+        self._node_min = np.zeros((0, 3))
+        self._node_max = np.zeros((0, 3))
+        self._node_child = np.zeros(0, dtype=np.int64)
+        self._node_start = np.zeros(0, dtype=np.int64)
+        self._node_count = np.zeros(0, dtype=np.int64)
+        # 階層ごとの先頭のノード番号
+        self._level_starts = np.zeros(0, dtype=np.int64)
+        if num_tris == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        corners = points[triangles]
+        tri_min = corners.min(axis=1)
+        tri_max = corners.max(axis=1)
+        centroid = (tri_min + tri_max) * 0.5
+        # 軸に平行なレイが境界上で抜けないようにボックスを少し広げる
+        pad = 1e-9 * max(float(np.abs(tri_max - tri_min).max()), 1.0)
+        tri_min = tri_min - pad
+        tri_max = tri_max + pad
+
+        order = np.arange(num_tris)
+        starts = np.array([0], dtype=np.int64)
+        counts = np.array([num_tris], dtype=np.int64)
+        node_min, node_max, node_child, node_start, node_count = [], [], [], [], []
+        next_id = 1
+        while len(starts):
+            num_nodes = len(starts)
+            sorted_min = tri_min[order]
+            sorted_max = tri_max[order]
+            node_min.append(np.minimum.reduceat(sorted_min, starts, axis=0))
+            node_max.append(np.maximum.reduceat(sorted_max, starts, axis=0))
+            node_start.append(starts)
+            node_count.append(counts)
+
+            is_split = counts > self.leaf_size
+            num_split = int(is_split.sum())
+            child = np.full(num_nodes, -1, dtype=np.int64)
+            child[is_split] = next_id + 2 * np.arange(num_split)
+            node_child.append(child)
+            next_id += 2 * num_split
+            if not num_split:
+                break
+
+            # 分割するノードは重心の広がりが最大の軸で並べ替える
+            sorted_centroid = centroid[order]
+            cen_min = np.minimum.reduceat(sorted_centroid, starts, axis=0)
+            cen_max = np.maximum.reduceat(sorted_centroid, starts, axis=0)
+            axis = np.argmax(cen_max - cen_min, axis=1)
+            seg_ids = np.repeat(np.arange(num_nodes), counts)
+            positions = np.arange(num_tris)
+            key = positions.astype(np.float64)
+            split_pos = is_split[seg_ids]
+            key[split_pos] = sorted_centroid[split_pos, axis[seg_ids[split_pos]]]
+            order = order[np.lexsort((key, seg_ids))]
+
+            split_starts = starts[is_split]
+            split_counts = counts[is_split]
+            half = split_counts // 2
+            starts = np.stack([split_starts, split_starts + half], axis=1).ravel()
+            counts = np.stack([half, split_counts - half], axis=1).ravel()
+
+        self._node_min = np.concatenate(node_min)
+        self._node_max = np.concatenate(node_max)
+        self._node_child = np.concatenate(node_child)
+        self._node_start = np.concatenate(node_start)
+        self._node_count = np.concatenate(node_count)
+        self._level_starts = np.cumsum([0] + [len(level) for level in node_start[:-1]])
+        return order
+
+    # トポロジーはそのままで頂点座標だけが変わった場合に、ノードのバウンディングボックスを更新する
+    def refit(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if points.shape != self.points.shape:
+            raise ValueError(f"Cannot refit BVH: expected {len(self.points)} points, got {len(points)}")
+        self.points = points
+        self._update_triangles()
+        if not self.num_triangles:
+            return
+        pad = 1e-9 * max(float(np.abs(self._tri_max - self._tri_min).max()), 1.0)
+        # 葉は三角形の範囲から、それ以外は子のボックスから、深い階層から順に求める
+        is_leaf = self._node_child < 0
+        leaves = np.nonzero(is_leaf)[0]
+        leaf_order = np.argsort(self._node_start[leaves])
+        leaves = leaves[leaf_order]
+        self._node_min[leaves] = np.minimum.reduceat(self._tri_min, self._node_start[leaves], axis=0) - pad
+        self._node_max[leaves] = np.maximum.reduceat(self._tri_max, self._node_start[leaves], axis=0) + pad
+        level_ends = np.append(self._level_starts[1:], len(self._node_child))
+        for start, end in zip(self._level_starts[::-1], level_ends[::-1]):
+            nodes = np.arange(start, end)[~is_leaf[start:end]]
+            child = self._node_child[nodes]
+            self._node_min[nodes] = np.minimum(self._node_min[child], self._node_min[child + 1])
+            self._node_max[nodes] = np.maximum(self._node_max[child], self._node_max[child + 1])
+
+    # レイとノードの交差を幅優先で走査し、葉に含まれる (レイ, 三角形) の組を返す
+    def _traverse(self, origins, directions, max_param, limit=None):
+        if not self.num_triangles or not len(origins):
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_dirs = 1.0 / directions
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        while rays.size:
+            ray_origins = origins[rays]
+            ray_inv = inv_dirs[rays]
+            with np.errstate(invalid='ignore'):
+                t_lo = (self._node_min[nodes] - ray_origins) * ray_inv
+                t_hi = (self._node_max[nodes] - ray_origins) * ray_inv
+            near = np.fmin(t_lo, t_hi)
+            far = np.fmax(t_lo, t_hi)
+            near[np.isnan(near)] = -np.inf
+            far[np.isnan(far)] = np.inf
+            t_near = np.maximum(near.max(axis=1), 0.0)
+            t_far = np.minimum(far.min(axis=1), max_param)
+            if limit is not None:
+                t_far = np.minimum(t_far, limit[rays])
+            hit = t_near <= t_far
+            rays = rays[hit]
+            nodes = nodes[hit]
+
+            child = self._node_child[nodes]
+            is_leaf = child < 0
+            if is_leaf.any():
+                leaf_rays = rays[is_leaf]
+                leaf_nodes = nodes[is_leaf]
+                leaf_counts = self._node_count[leaf_nodes]
+                total = int(leaf_counts.sum())
+                offsets = np.arange(total) - np.repeat(np.cumsum(leaf_counts) - leaf_counts, leaf_counts)
+                tris = np.repeat(self._node_start[leaf_nodes], leaf_counts) + offsets
+                yield np.repeat(leaf_rays, leaf_counts), tris
+
+            inner_rays = rays[~is_leaf]
+            inner_child = child[~is_leaf]
+            rays = np.repeat(inner_rays, 2)
+            nodes = np.stack([inner_child, inner_child + 1], axis=1).ravel()
+
+    # 2つのBVHを同時に走査し、バウンディングボックスが重なる三角形の組を返す
+    # tolerance を指定するとその距離まで離れた組も候補に含める
+    # transform を指定すると other の座標をその行列で自分の座標系に変換して比較する
+    def overlap_candidates(self, other, tolerance=0.0, transform=None):
+        if not self.num_triangles or not other.num_triangles:
+            return
+        other_min, other_max = other._node_min, other._node_max
+        other_tri_min, other_tri_max = other._tri_min, other._tri_max
+        if transform is not None:
+            other_min, other_max = transform_bounds(other_min, other_max, transform)
+            other_tri_min, other_tri_max = transform_bounds(other_tri_min, other_tri_max, transform)
+        nodes_a = np.zeros(1, dtype=np.int64)
+        nodes_b = np.zeros(1, dtype=np.int64)
+        while nodes_a.size:
+            overlap = np.all(
+                (self._node_min[nodes_a] <= other_max[nodes_b] + tolerance)
+                & (other_min[nodes_b] <= self._node_max[nodes_a] + tolerance),
+                axis=1,
+            )
+            nodes_a = nodes_a[overlap]
+            nodes_b = nodes_b[overlap]
+            child_a = self._node_child[nodes_a]
+            child_b = other._node_child[nodes_b]
+            leaf_a = child_a < 0
+            leaf_b = child_b < 0
+
+            both_leaf = leaf_a & leaf_b
+            if both_leaf.any():
+                tris_a, tris_b = self._leaf_products(
+                    other, nodes_a[both_leaf], nodes_b[both_leaf])
+                # 三角形単位のバウンディングボックスでも絞り込む
+                keep = np.all(
+                    (self._tri_min[tris_a] <= other_tri_max[tris_b] + tolerance)
+                    & (other_tri_min[tris_b] <= self._tri_max[tris_a] + tolerance),
+                    axis=1,
+                )
+                yield tris_a[keep], tris_b[keep]
+
+            # 葉でない側のうち三角形の多い方を分割する
+            split_a = ~leaf_a & (leaf_b | (self._node_count[nodes_a] >= other._node_count[nodes_b]))
+            split_b = ~both_leaf & ~split_a
+            nodes_a = np.concatenate([
+                np.repeat(child_a[split_a], 2) + np.tile([0, 1], int(split_a.sum())),
+                np.repeat(nodes_a[split_b], 2),
+            ])
+            nodes_b = np.concatenate([
+                np.repeat(nodes_b[split_a], 2),
+                np.repeat(child_b[split_b], 2) + np.tile([0, 1], int(split_b.sum())),
+            ])
+
+    # バウンディングボックス (min, max) と重なる三角形の番号を返す
+    def triangles_in_bounds(self, bounds_min, bounds_max):
+        found = [np.zeros(0, dtype=np.int64)]
+        if not self.num_triangles:
+            return found[0]
+        nodes = np.zeros(1, dtype=np.int64)
+        while nodes.size:
+            overlap = np.all((self._node_min[nodes] <= bounds_max) & (bounds_min <= self._node_max[nodes]), axis=1)
+            nodes = nodes[overlap]
+            child = self._node_child[nodes]
+            is_leaf = child < 0
+            leaf_nodes = nodes[is_leaf]
+            if leaf_nodes.size:
+                leaf_counts = self._node_count[leaf_nodes]
+                offsets = np.arange(int(leaf_counts.sum())) - np.repeat(np.cumsum(leaf_counts) - leaf_counts, leaf_counts)
+                tris = np.repeat(self._node_start[leaf_nodes], leaf_counts) + offsets
+                keep = np.all((self._tri_min[tris] <= bounds_max) & (bounds_min <= self._tri_max[tris]), axis=1)
+                found.append(tris[keep])
+            inner_child = child[~is_leaf]
+            nodes = np.stack([inner_child, inner_child + 1], axis=1).ravel()
+        return np.concatenate(found)
+
+    # 1つのBVH内でバウンディングボックスが重なる三角形の組 (tris_a < tris_b) を返す
+    def self_overlap_candidates(self):
+        if not self.num_triangles:
+            return
+        nodes_a = np.zeros(1, dtype=np.int64)
+        nodes_b = np.zeros(1, dtype=np.int64)
+        while nodes_a.size:
+            same = nodes_a == nodes_b
+            overlap = same | np.all(
+                (self._node_min[nodes_a] <= self._node_max[nodes_b])
+                & (self._node_min[nodes_b] <= self._node_max[nodes_a]),
+                axis=1,
+            )
+            nodes_a, nodes_b, same = nodes_a[overlap], nodes_b[overlap], same[overlap]
+            child_a = self._node_child[nodes_a]
+            child_b = self._node_child[nodes_b]
+            leaf_a = child_a < 0
+            leaf_b = child_b < 0
+
+            both_leaf = leaf_a & leaf_b
+            if both_leaf.any():
+                tris_a, tris_b = self._leaf_products(self, nodes_a[both_leaf], nodes_b[both_leaf])
+                # 同じ葉の中の組は片方の順序だけを残す
+                keep = (tris_a < tris_b) & np.all(
+                    (self._tri_min[tris_a] <= self._tri_max[tris_b])
+                    & (self._tri_min[tris_b] <= self._tri_max[tris_a]),
+                    axis=1,
+                )
+                yield tris_a[keep], tris_b[keep]
+
+            # 同じノード同士は子の3通りの組に分割する
+            split_same = same & ~leaf_a
+            same_child = child_a[split_same]
+            # 異なるノード同士は葉でない側のうち三角形の多い方を分割する
+            other = ~same & ~both_leaf
+            split_a = other & ~leaf_a & (leaf_b | (self._node_count[nodes_a] >= self._node_count[nodes_b]))
+            split_b = other & ~split_a
+            nodes_a = np.concatenate([
+                same_child, same_child + 1, same_child,
+                np.repeat(child_a[split_a], 2) + np.tile([0, 1], int(split_a.sum())),
+                np.repeat(nodes_a[split_b], 2),
+            ])
+            nodes_b = np.concatenate([
+                same_child, same_child + 1, same_child + 1,
+                np.repeat(nodes_b[split_a], 2),
+                np.repeat(child_b[split_b], 2) + np.tile([0, 1], int(split_b.sum())),
+            ])
+
+    # 葉ノードの組に含まれる三角形の全組み合わせを作成
+    def _leaf_products(self, other, leaf_a, leaf_b):
+        counts_a = self._node_count[leaf_a]
+        counts_b = other._node_count[leaf_b]
+        pair_counts = counts_a * counts_b
+        total = int(pair_counts.sum())
+        local = np.arange(total) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+        width = np.repeat(counts_b, pair_counts)
+        tris_a = np.repeat(self._node_start[leaf_a], pair_counts) + local // width
+        tris_b = np.repeat(other._node_start[leaf_b], pair_counts) + local % width
+        return tris_a, tris_b
+
+    # Moller-Trumbore 法でレイと三角形の交差をまとめて判定
+    def _intersect(self, origins, directions, rays, tris, max_param):
+        ray_dirs = directions[rays]
+        e1 = self._e1[tris]
+        e2 = self._e2[tris]
+        pvec = np.cross(ray_dirs, e2)
+        det = np.einsum('ij,ij->i', e1, pvec)
+        valid = np.abs(det) > INTERSECT_EPSILON
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = np.where(valid, 1.0 / np.where(valid, det, 1.0), 0.0)
+            tvec = origins[rays] - self._v0[tris]
+            u = np.einsum('ij,ij->i', tvec, pvec) * inv_det
+            qvec = np.cross(tvec, e1)
+            v = np.einsum('ij,ij->i', ray_dirs, qvec) * inv_det
+            t = np.einsum('ij,ij->i', e2, qvec) * inv_det
+        hit = valid & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t > 0.0) & (t <= max_param)
+        return hit, t
+
+    # 各レイが何回メッシュと交差するかを数える
+    def count_crossings(self, origins, directions, max_param=99999.0):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        crossings = np.zeros(len(origins), dtype=np.int64)
+        for begin in range(0, len(origins), RAY_CHUNK_SIZE):
+            chunk_origins = origins[begin:begin + RAY_CHUNK_SIZE]
+            chunk_dirs = directions[begin:begin + RAY_CHUNK_SIZE]
+            for rays, tris in self._traverse(chunk_origins, chunk_dirs, max_param):
+                hit, _ = self._intersect(chunk_origins, chunk_dirs, rays, tris, max_param)
+                crossings[begin:begin + len(chunk_origins)] += np.bincount(
+                    rays[hit], minlength=len(chunk_origins))
+        return crossings
+
+    # 全ての交差を (レイ番号, レイパラメータ) の配列で返す
+    def all_hits(self, origins, directions, max_param=99999.0):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        hit_rays = [np.zeros(0, dtype=np.int64)]
+        hit_params = [np.zeros(0)]
+        for begin in range(0, len(origins), RAY_CHUNK_SIZE):
+            chunk_origins = origins[begin:begin + RAY_CHUNK_SIZE]
+            chunk_dirs = directions[begin:begin + RAY_CHUNK_SIZE]
+            for rays, tris in self._traverse(chunk_origins, chunk_dirs, max_param):
+                hit, t = self._intersect(chunk_origins, chunk_dirs, rays, tris, max_param)
+                hit_rays.append(rays[hit] + begin)
+                hit_params.append(t[hit])
+        return np.concatenate(hit_rays), np.concatenate(hit_params)
+
+    # 各レイが最初に当たるフェース番号とレイパラメータを返す (当たらない場合は -1, inf)
+    def first_hits(self, origins, directions, max_param=99999.0):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        best_t = np.full(len(origins), np.inf)
+        best_tri = np.full(len(origins), -1, dtype=np.int64)
+        for begin in range(0, len(origins), RAY_CHUNK_SIZE):
+            end = begin + RAY_CHUNK_SIZE
+            chunk_origins = origins[begin:end]
+            chunk_dirs = directions[begin:end]
+            # 走査中に見つかった最短距離より遠いノードは打ち切る
+            chunk_t = best_t[begin:end]
+            chunk_tri = best_tri[begin:end]
+            for rays, tris in self._traverse(chunk_origins, chunk_dirs, max_param, limit=chunk_t):
+                hit, t = self._intersect(chunk_origins, chunk_dirs, rays, tris, max_param)
+                rays, tris, t = rays[hit], tris[hit], t[hit]
+                if not rays.size:
+                    continue
+                sort = np.lexsort((t, rays))
+                rays, tris, t = rays[sort], tris[sort], t[sort]
+                first = np.ones(len(rays), dtype=bool)
+                first[1:] = rays[1:] != rays[:-1]
+                rays, tris, t = rays[first], tris[first], t[first]
+                closer = t < chunk_t[rays]
+                chunk_t[rays[closer]] = t[closer]
+                chunk_tri[rays[closer]] = tris[closer]
+        if not self.num_triangles:
+            return best_tri, best_t
+        faces = np.where(best_tri >= 0, self.tri_faces[np.maximum(best_tri, 0)], -1)
+        return faces, best_t
+
+    # ノードごとに面積ベクトルの合計と面積で重み付けした中心を求める
+    def _build_dipoles(self):
+        area_vectors = 0.5 * np.cross(self._e1, self._e2)
+        areas = np.linalg.norm(area_vectors, axis=1)
+        centroids = self._v0 + (self._e1 + self._e2) / 3.0
+        # 葉の並び順の累積和から各ノードの三角形の範囲の合計を求める
+        cum_vectors = np.concatenate([np.zeros((1, 3)), np.cumsum(area_vectors, axis=0)])
+        cum_areas = np.concatenate([[0.0], np.cumsum(areas)])
+        cum_moments = np.concatenate([np.zeros((1, 3)), np.cumsum(centroids * areas[:, None], axis=0)])
+        cum_centroids = np.concatenate([np.zeros((1, 3)), np.cumsum(centroids, axis=0)])
+        starts = self._node_start
+        ends = starts + self._node_count
+        node_areas = cum_areas[ends] - cum_areas[starts]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centers = (cum_moments[ends] - cum_moments[starts]) / node_areas[:, None]
+        # 面積のない三角形だけのノードは重心の平均を使う
+        degenerate = ~(node_areas > 0)
+        centers[degenerate] = ((cum_centroids[ends] - cum_centroids[starts])[degenerate]
+                               / self._node_count[degenerate, None])
+        self._node_dipole = cum_vectors[ends] - cum_vectors[starts]
+        self._node_center = centers
+        # 中心からバウンディングボックスの最も遠い角までの距離
+        self._node_radius = np.linalg.norm(
+            np.maximum(self._node_max - centers, centers - self._node_min), axis=1)
+
+    # 点から見た三角形の立体角をまとめて求める (Van Oosterom-Strackee の式)
+    def _solid_angles(self, points, tris):
+        a = self._v0[tris] - points
+        b = a + self._e1[tris]
+        c = a + self._e2[tris]
+        len_a = np.linalg.norm(a, axis=1)
+        len_b = np.linalg.norm(b, axis=1)
+        len_c = np.linalg.norm(c, axis=1)
+        numerator = np.einsum('ij,ij->i', a, np.cross(b, c))
+        denominator = (len_a * len_b * len_c + np.einsum('ij,ij->i', a, b) * len_c
+                       + np.einsum('ij,ij->i', b, c) * len_a + np.einsum('ij,ij->i', c, a) * len_b)
+        return 2.0 * np.arctan2(numerator, denominator)
+
+    # 各点の一般化巻き数をまとめて求める (閉じたメッシュの内部でおよそ ±1、外部で 0)
+    # ノードの中心から半径の accuracy 倍より離れた点には双極子による遠方近似を使う
+    def winding_numbers(self, points, accuracy=WINDING_ACCURACY):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        winding = np.zeros(len(points))
+        if not self.num_triangles or not len(points):
+            return winding
+        if self._node_dipole is None:
+            self._build_dipoles()
+        for begin in range(0, len(points), RAY_CHUNK_SIZE):
+            chunk_points = points[begin:begin + RAY_CHUNK_SIZE]
+            chunk_winding = np.zeros(len(chunk_points))
+            queries = np.arange(len(chunk_points))
+            nodes = np.zeros(len(chunk_points), dtype=np.int64)
+            while queries.size:
+                offsets = self._node_center[nodes] - chunk_points[queries]
+                distances = np.linalg.norm(offsets, axis=1)
+                far = distances > accuracy * self._node_radius[nodes]
+                if far.any():
+                    far_nodes = nodes[far]
+                    contribution = (np.einsum('ij,ij->i', offsets[far], self._node_dipole[far_nodes])
+                                    / distances[far] ** 3)
+                    chunk_winding += np.bincount(queries[far], contribution, minlength=len(chunk_points))
+                queries = queries[~far]
+                nodes = nodes[~far]
+
+                child = self._node_child[nodes]
+                is_leaf = child < 0
+                if is_leaf.any():
+                    leaf_queries = queries[is_leaf]
+                    leaf_nodes = nodes[is_leaf]
+                    leaf_counts = self._node_count[leaf_nodes]
+                    total = int(leaf_counts.sum())
+                    offsets = np.arange(total) - np.repeat(np.cumsum(leaf_counts) - leaf_counts, leaf_counts)
+                    tris = np.repeat(self._node_start[leaf_nodes], leaf_counts) + offsets
+                    leaf_queries = np.repeat(leaf_queries, leaf_counts)
+                    angles = self._solid_angles(chunk_points[leaf_queries], tris)
+                    chunk_winding += np.bincount(leaf_queries, angles, minlength=len(chunk_points))
+
+                inner_queries = queries[~is_leaf]
+                inner_child = child[~is_leaf]
+                queries = np.repeat(inner_queries, 2)
+                nodes = np.stack([inner_child, inner_child + 1], axis=1).ravel()
+            winding[begin:begin + len(chunk_points)] = chunk_winding
+        return winding / (4.0 * np.pi)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+# キャッシュが使うメモリの上限 (バイト)
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+
+# メッシュの頂点座標とフェース構成からハッシュ値を作成
+def mesh_signature(mesh):
+    digest = hashlib.sha1()
+    for array in (mesh.face_counts, mesh.face_connects, mesh.points):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+# オブジェクトが保持しているnumpy配列の合計サイズを求める
+def array_nbytes(*objects):
+    total = 0
+    for obj in objects:
+        if obj is None:
+            continue
+        for value in vars(obj).values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+    return total
+
+
+# 1メッシュ分のキャッシュデータ
+class MeshCacheEntry(object):
+
+    def __init__(self, key, mesh, bvh=None, signature=None):
+        self.key = key
+        self.mesh = mesh
+        self.bvh = bvh
+        self.signature = signature
+        # メッシュの座標系 (インスタンスの場合はオブジェクト空間) のバウンディングボックス
+        self.bounds = bvh.bounds if bvh is not None else mesh.bounds
+        self.nbytes = array_nbytes(mesh, bvh)
+
+
+# シェイプのDAGパスをキーにしたLRUキャッシュ
+class MeshCache(object):
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    # キャッシュを取得 (signature を指定した場合は一致しなければ破棄する)
+    def get(self, key, signature=None):
+        entry = self.entries.get(key)
+        if entry is not None and signature is not None and entry.signature != signature:
+            self.invalidate(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    # キャッシュを追加し、上限を超えた分は古いものから破棄する
+    def put(self, key, mesh, bvh=None, signature=None):
+        self.invalidate(key)
+        entry = MeshCacheEntry(key, mesh, bvh, signature)
+        self.entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.memory_budget and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self.invalidate(oldest)
+        return entry
+
+    # 頂点座標とフェース構成が同じメッシュのキャッシュを探す (複製されたメッシュの共有に使う)
+    def find_signature(self, signature):
+        for entry in reversed(self.entries.values()):
+            if entry.signature == signature:
+                return entry
+        return None
+
+    # 後から作成したBVHをキャッシュに追加
+    def set_bvh(self, key, mesh, bvh):
+        entry = self.entries.get(key)
+        # 作成中にキャッシュが破棄・更新された場合は何もしない
+        if bvh is None or entry is None or entry.mesh is not mesh or entry.bvh is not None:
+            return
+        self.put(key, mesh, bvh, entry.signature)
+
+    # キャッシュを破棄
+    def invalidate(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+# 形状が変わったとみなすメッシュのアトリビュート
+# キャッシュはオブジェクト空間なので、移動で変わる worldMesh は含めない
+GEOMETRY_ATTRIBUTES = ("inMesh", "outMesh", "cachedInMesh", "pnts", "vrts")
+
+
+# プラグのルートのアトリビュート名を取得
+def root_attribute_name(plug):
+    while plug.isChild:
+        plug = plug.parent()
+    if plug.isElement:
+        plug = plug.array()
+    return plug.partialName(useLongNames=True)
+
+
+# Mayaのコールバックでメッシュの変更を監視し、キャッシュを破棄する
+class MayaDirtyTracker(object):
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.callback_ids = {}
+        # インスタンスのDAGパス -> ワールド行列の変更のコールバック
+        self.transform_callback_ids = {}
+        # 変更があったときに呼び出す関数 (引数はキー)
+        self.listeners = []
+        # 0 より大きい間はプラグの変更を無視する (muted で増減する)
+        self._mute_count = 0
+
+    # with文の間に起きたプラグの変更を無視する
+    # ヒストリのあるメッシュではフェースへのマテリアルの割り当てで groupParts が inMesh につながるが、形状は変わらない
+    @contextmanager
+    def muted(self):
+        self._mute_count += 1
+        try:
+            yield
+        finally:
+            self._mute_count -= 1
+
+    def is_watching(self, key):
+        return key in self.callback_ids
+
+    # シェイプのプラグ変更を監視 (登録できなかった場合は False)
+    def watch(self, key, dag_path):
+        if key in self.callback_ids:
+            return True
+        from maya.api import OpenMaya as om2
+        # マテリアルの割り当てなどでは破棄しないよう、形状に関わるプラグだけを見る
+        def on_plug_dirty(node, plug, *args):
+            if not self._mute_count and root_attribute_name(plug) in GEOMETRY_ATTRIBUTES:
+                self.on_dirty(key)
+
+        try:
+            callback_ids = [om2.MNodeMessage.addNodeDirtyPlugCallback(dag_path.node(), on_plug_dirty)]
+        except RuntimeError as e:
+            print(f"Error: Could not watch {key}: {str(e)}")
+            return False
+        self.callback_ids[key] = callback_ids
+        return True
+
+    # インスタンスのワールド行列の変更を監視 (キャッシュは破棄せず、変更だけを通知する)
+    def watch_transform(self, key, dag_path):
+        if key in self.transform_callback_ids:
+            return True
+        from maya.api import OpenMaya as om2
+        try:
+            callback_id = om2.MDagMessage.addWorldMatrixModifiedCallback(dag_path, lambda *args: self.notify(key))
+        except RuntimeError as e:
+            print(f"Error: Could not watch {key}: {str(e)}")
+            return False
+        self.transform_callback_ids[key] = callback_id
+        return True
+
+    # 変更があったメッシュのキャッシュを破棄
+    def on_dirty(self, key):
+        self.cache.invalidate(key)
+        self.notify(key)
+
+    def notify(self, key):
+        for listener in self.listeners:
+            listener(key)
+
+    def unwatch(self, key):
+        from maya.api import OpenMaya as om2
+        for callback_id in self.callback_ids.pop(key, []):
+            om2.MMessage.removeCallback(callback_id)
+        callback_id = self.transform_callback_ids.pop(key, None)
+        if callback_id is not None:
+            om2.MMessage.removeCallback(callback_id)
+
+    def remove_all(self):
+        for key in set(self.callback_ids) | set(self.transform_callback_ids):
+            self.unwatch(key)
@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from overlap_bvh import MeshBVH
+from overlap_broadphase import sweep_and_prune
+from overlap_geometry import MeshArrays
+from overlap_instance import InstancedBVH, InstancedMesh, local_frame
+from overlap_narrowphase import (any_within_distance, faces_within_distance, intersecting_faces,
+                                 intersecting_triangle_pairs, self_intersecting_faces)
+from overlap_pointset import DEFAULT_TOLERANCE, VoxelPointSet, intersect_bounds, points_inside_bounds
+from overlap_profile import SearchProfile
+from overlap_proxy import MeshProxy
+from overlap_voxel import (MAX_VOXEL_CELLS, SurfaceVoxels, cell_count, default_voxel_size, overlap_volume,
+                           refine_shared_voxels, surface_cell_count)
+
+# 判定方法 (Sample: サンプルポイントのレイキャスト, Exact: 三角形同士の交差判定,
+# Voxel: 表面のボクセルが重なる部分だけ三角形同士の交差判定, Self: 1つのメッシュ内の自己交差,
+# Clearance: 指定した距離より近いフェース, Progressive: 代理メッシュで重なるオブジェクトを先に求めてから Exact)
+SEARCH_MODES = ("Sample", "Exact", "Voxel", "Self", "Clearance", "Progressive")
+
+# フレーム範囲を判定する方法 (フレームごとに三角形同士の交差判定)
+FRAME_RANGE_MODE = "Frame Range"
+
+# Clearance で近すぎるとみなす距離 (0.5mm)
+DEFAULT_CLEARANCE = 0.05
+
+# 内部判定の方法 (Ray Parity: レイの交差回数の偶奇, Winding Number: 一般化巻き数)
+CONTAINMENT_METHODS = ("Ray Parity", "Winding Number")
+
+# サンプルポイントから飛ばすレイの方向
+RAY_DIRECTIONS = np.array([
+    (0, -1, 0),
+    (0, 1, 0),
+    (-1, 0, 0),
+    (1, 0, 0),
+    (0, 0, -1),
+    (0, 0, 1),
+], dtype=np.float64)
+
+
+# 判定が中断されたときに送出する例外
+class SearchCancelled(Exception):
+    pass
+
+
+# 判定の進捗通知と中断要求を受け渡す
+class SearchMonitor(object):
+
+    def __init__(self, on_pair_done=None, on_progress=None, on_coarse_done=None):
+        # on_pair_done(完了数, 全体数, メッシュ番号1, メッシュ番号2, フェース1, フェース2)
+        self.on_pair_done = on_pair_done
+        # on_progress(完了数, 全体数)
+        self.on_progress = on_progress
+        # on_coarse_done([(メッシュ番号1, メッシュ番号2), ...])
+        self.on_coarse_done = on_coarse_done
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise SearchCancelled()
+
+    # ペアの判定が終わるごとに呼び出す
+    def pair_done(self, done, total, i, j, faces1=(), faces2=()):
+        if self.on_pair_done is not None:
+            self.on_pair_done(done, total, i, j, faces1, faces2)
+        self.check_cancelled()
+
+    # Progressive の粗い判定で重なったメッシュの組を通知する
+    def coarse_done(self, pairs):
+        if self.on_coarse_done is not None:
+            self.on_coarse_done(pairs)
+        self.check_cancelled()
+
+    # ペア以外の単位 (フレームなど) で進捗を通知する
+    def progress(self, done, total):
+        if self.on_progress is not None:
+            self.on_progress(done, total)
+        self.check_cancelled()
+
+
+# 衝突判定の結果
+class OverlapResult(object):
+
+    def __init__(self, mesh_names, mode, profile=None):
+        self.mesh_names = list(mesh_names)
+        self.mode = mode
+        # 段階ごとの処理時間とカウンタ
+        self.profile = profile if profile is not None else SearchProfile()
+        # メッシュ番号ごとの重なっているフェース番号
+        self.mesh_faces = {}
+        # 重なっているメッシュの組ごとのフェース番号
+        self.pair_faces = {}
+        # Voxel で求めたメッシュの組ごとのめり込んでいる体積
+        self.pair_volumes = {}
+        # Clearance で求めたメッシュの組ごとのフェースの最短距離 (フェース1, フェース2 と同じ並び)
+        self.pair_distances = {}
+        self.candidate_pairs = 0
+        self.culled_pairs = 0
+        # 差分判定で再計算したペア数と前回の結果を使ったペア数
+        self.evaluated_pairs = 0
+        self.reused_pairs = 0
+        # Progressive の粗い判定で重なったメッシュの組
+        self.coarse_pairs = None
+
+    @property
+    def has_overlap(self):
+        return bool(self.mesh_faces) or bool(self.pair_faces)
+
+    # メッシュのフェースを追加
+    def add_faces(self, index, faces):
+        faces = np.asarray(faces, dtype=np.int64)
+        if not len(faces):
+            return
+        if index in self.mesh_faces:
+            faces = np.concatenate([self.mesh_faces[index], faces])
+        self.mesh_faces[index] = np.unique(faces)
+
+    # メッシュの組ごとのフェースを追加
+    def add_pair(self, i, j, faces1=(), faces2=()):
+        self.pair_faces[(int(i), int(j))] = (
+            np.asarray(faces1, dtype=np.int64), np.asarray(faces2, dtype=np.int64))
+        self.add_faces(i, faces1)
+        self.add_faces(j, faces2)
+
+    # メッシュ名ごとのフェース番号
+    def faces_by_name(self):
+        return {self.mesh_names[index]: faces for index, faces in sorted(self.mesh_faces.items())}
+
+    # メッシュの組の結果をレポート出力用の辞書に変換
+    def pair_to_dict(self, i, j):
+        faces1, faces2 = self.pair_faces[(i, j)]
+        pair = {
+            "mesh1": self.mesh_names[i],
+            "mesh2": self.mesh_names[j],
+            "faces1": faces1.tolist(),
+            "faces2": faces2.tolist(),
+        }
+        if (i, j) in self.pair_volumes:
+            pair["volume"] = self.pair_volumes[(i, j)]
+        if (i, j) in self.pair_distances:
+            distances1, distances2 = self.pair_distances[(i, j)]
+            pair["distances1"] = distances1.tolist()
+            pair["distances2"] = distances2.tolist()
+        return pair
+
+    # レポート出力用の辞書に変換
+    def to_dict(self):
+        return {
+            "mode": self.mode,
+            "meshes": self.mesh_names,
+            "candidate_pairs": self.candidate_pairs,
+            "culled_pairs": self.culled_pairs,
+            "evaluated_pairs": self.evaluated_pairs,
+            "reused_pairs": self.reused_pairs,
+            "coarse_pairs": ([[self.mesh_names[i], self.mesh_names[j]] for i, j in self.coarse_pairs]
+                             if self.coarse_pairs is not None else None),
+            "overlapping_pairs": [self.pair_to_dict(i, j) for i, j in sorted(self.pair_faces)],
+            "faces": {name: faces.tolist() for name, faces in self.faces_by_name().items()},
+            "profile": self.profile.to_dict(),
+        }
+
+
+# フレーム範囲の衝突判定の結果
+# OverlapResult には全フレームで重なったフェースをまとめて持ち、フレームごとの結果は frame_pairs に持つ
+class OverlapTimeline(OverlapResult):
+
+    def __init__(self, mesh_names, profile=None):
+        super(OverlapTimeline, self).__init__(mesh_names, FRAME_RANGE_MODE, profile)
+        self.frames = []
+        # フレーム -> (メッシュ番号1, メッシュ番号2) -> (フェース1, フェース2)
+        self.frame_pairs = OrderedDict()
+
+    def add_frame(self, frame):
+        self.frames.append(frame)
+        self.frame_pairs[frame] = {}
+
+    # フレームごとのフェースを追加し、全フレームの結果にもまとめる
+    def add_frame_pair(self, frame, i, j, faces1=(), faces2=()):
+        faces1 = np.asarray(faces1, dtype=np.int64)
+        faces2 = np.asarray(faces2, dtype=np.int64)
+        self.frame_pairs[frame][(int(i), int(j))] = (faces1, faces2)
+        if (i, j) in self.pair_faces:
+            merged1, merged2 = self.pair_faces[(i, j)]
+            faces1, faces2 = np.union1d(merged1, faces1), np.union1d(merged2, faces2)
+        self.add_pair(i, j, faces1, faces2)
+
+    # 重なりがあったフレーム
+    @property
+    def overlap_frames(self):
+        return [frame for frame, pairs in self.frame_pairs.items() if pairs]
+
+    def to_dict(self):
+        report = super(OverlapTimeline, self).to_dict()
+        report["timeline"] = [
+            {
+                "frame": frame,
+                "pairs": [
+                    {
+                        "mesh1": self.mesh_names[i],
+                        "mesh2": self.mesh_names[j],
+                        "faces1": faces1.tolist(),
+                        "faces2": faces2.tolist(),
+                    }
+                    for (i, j), (faces1, faces2) in sorted(pairs.items())
+                ],
+            }
+            for frame, pairs in self.frame_pairs.items()
+        ]
+        return report
+
+
+# UIに依存しない衝突判定
+class OverlapEngine(object):
+
+    def __init__(self, mode="Sample", seed=None, tolerance=DEFAULT_TOLERANCE, containment="Ray Parity",
+                 voxel_size=None, clearance=DEFAULT_CLEARANCE):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        if containment not in CONTAINMENT_METHODS:
+            raise ValueError(f"Unknown containment method: {containment}")
+        self.mode = mode
+        self.containment = containment
+        # Voxel のボクセルの一辺 (None の場合はペアのバウンディングボックスの重なりの大きさから決める)
+        self.voxel_size = voxel_size
+        # Clearance で近すぎるとみなす距離
+        self.clearance = clearance
+        # サンプルポイントを作るときの乱数のシード
+        self.seed = seed
+        # 内部の点を同じ点とみなす距離
+        self.tolerance = tolerance
+        # 差分判定用に前回のペアごとの結果を (キー1, キー2) -> (フェース1, フェース2) で保持
+        self.pair_results = {}
+        # メッシュ -> Progressive の代理メッシュ (メッシュが破棄されたら一緒に破棄する)
+        self.proxies = weakref.WeakKeyDictionary()
+
+    # メッシュの頂点配列からBVHを作成
+    def build_mesh_bvh(self, mesh):
+        return MeshBVH.from_polygons(mesh.points, mesh.face_counts, mesh.face_connects)
+
+    # ワールド空間のバウンディングボックスが重なるペアだけを候補にする
+    # tolerance を指定するとその距離まで離れたペアも候補に含める
+    def get_candidate_pairs(self, bvhs, result=None, tolerance=0.0):
+        profile = result.profile if result is not None else SearchProfile()
+        with profile.stage("broad phase"):
+            bounds = [bvh.bounds for bvh in bvhs]
+            candidate_pairs, culled_pairs = sweep_and_prune(
+                [b[0] for b in bounds], [b[1] for b in bounds], tolerance)
+        profile.count("candidate pairs", len(candidate_pairs))
+        profile.count("pairs culled", culled_pairs)
+        if result is not None:
+            result.candidate_pairs = len(candidate_pairs)
+            result.culled_pairs = culled_pairs
+        return candidate_pairs
+
+    # BVHが未作成のメッシュだけBVHを作成
+    # インスタンスはオブジェクト空間のメッシュごとに一度だけ作成して共有する
+    # (share_instances が False の場合はワールド空間のBVHを個別に作成する)
+    def build_missing_bvhs(self, meshes, bvhs=None, monitor=None, profile=None, share_instances=True):
+        if bvhs is None:
+            bvhs = [None] * len(meshes)
+        if profile is None:
+            profile = SearchProfile()
+        # 共有しているメッシュ -> オブジェクト空間のBVH
+        shared = {}
+        for mesh, bvh in zip(meshes, bvhs):
+            if isinstance(mesh, InstancedMesh) and bvh is not None:
+                shared[id(mesh.mesh)] = local_frame(bvh)[0]
+        built = []
+        for mesh, bvh in zip(meshes, bvhs):
+            if monitor is not None:
+                monitor.check_cancelled()
+            if bvh is None and share_instances and isinstance(mesh, InstancedMesh):
+                local_bvh = shared.get(id(mesh.mesh))
+                if local_bvh is None:
+                    with profile.stage("bvh build"):
+                        local_bvh = self.build_mesh_bvh(mesh.mesh)
+                    profile.count("bvhs built")
+                    shared[id(mesh.mesh)] = local_bvh
+                else:
+                    profile.count("bvhs shared")
+                bvh = InstancedBVH(local_bvh, mesh.matrix)
+            elif bvh is None:
+                with profile.stage("bvh build"):
+                    bvh = self.build_mesh_bvh(mesh)
+                profile.count("bvhs built")
+            built.append(bvh)
+        return built
+
+    # 複数のメッシュの衝突判定を行う
+    def search(self, meshes, bvhs=None, mode=None, monitor=None, profile=None, containment=None, voxel_size=None,
+               clearance=None):
+        mode = mode or self.mode
+        if mode == "Progressive":
+            return self.progressive_search(meshes, bvhs, monitor, profile)[0]
+        result = OverlapResult([mesh.name for mesh in meshes], mode, profile)
+        bvhs = self.build_missing_bvhs(meshes, bvhs, monitor, result.profile)
+        if mode == "Self":
+            return self.self_search(bvhs, result, monitor)
+        if mode == "Clearance":
+            return self.clearance_search(bvhs, result, monitor, clearance)
+        candidate_pairs = self.get_candidate_pairs(bvhs, result)
+        if mode == "Exact":
+            self.exact_search(bvhs, candidate_pairs, result, monitor)
+        elif mode == "Voxel":
+            self.voxel_search(bvhs, candidate_pairs, result, monitor, voxel_size)
+        else:
+            sample_points = self.generate_sample_points(meshes, bvhs, candidate_pairs, result, monitor, containment)
+            # 内部の点が見つかったペアのメッシュだけにレイを飛ばす
+            overlap_indices = sorted(set(index for pair in result.pair_faces for index in pair))
+            with result.profile.stage("ray casts"):
+                for index in overlap_indices:
+                    hit_faces = self.sample_point_ray_cast(bvhs[index], sample_points)
+                    result.add_faces(index, hit_faces[hit_faces >= 0])
+            result.profile.count("rays cast", len(overlap_indices) * len(sample_points) * len(RAY_DIRECTIONS))
+        return result
+
+    # 三角形同士の交差判定で重なっているフェースを求める
+    def exact_search(self, bvhs, candidate_pairs, result, monitor=None):
+        profile = result.profile
+        for done, (i, j) in enumerate(candidate_pairs, 1):
+            with profile.stage("narrow phase"):
+                faces1, faces2 = intersecting_faces(bvhs[i], bvhs[j])
+            profile.count("pairs evaluated")
+            profile.trace(f"pair {i} {j}: {len(faces1)} / {len(faces2)} faces")
+            if len(faces1) or len(faces2):
+                result.add_pair(i, j, faces1, faces2)
+            if monitor is not None:
+                monitor.pair_done(done, len(candidate_pairs), i, j, faces1, faces2)
+        return result
+
+    # 代理メッシュとそのBVHを取得 (なければ作成) し、(BVH, 頂点が動いた距離の上限) のリストを返す
+    # インスタンスはオブジェクト空間の代理メッシュを共有する
+    def get_proxies(self, meshes, monitor=None, profile=None):
+        profile = profile if profile is not None else SearchProfile()
+        proxies = []
+        for mesh in meshes:
+            if monitor is not None:
+                monitor.check_cancelled()
+            local_mesh = mesh.mesh if isinstance(mesh, InstancedMesh) else mesh
+            proxy = self.proxies.get(local_mesh)
+            if proxy is None:
+                with profile.stage("proxy build"):
+                    proxy = MeshProxy(local_mesh)
+                profile.count("proxies built")
+                self.proxies[local_mesh] = proxy
+            if isinstance(mesh, InstancedMesh):
+                # 最も伸びる方向の倍率で移動距離の上限をワールド空間に合わせる
+                error = proxy.error * float(np.linalg.norm(mesh.matrix[:3, :3], 2))
+                proxies.append((InstancedBVH(proxy.bvh, mesh.matrix), error))
+            else:
+                proxies.append((proxy.bvh, proxy.error))
+        return proxies
+
+    # 代理メッシュで重なっているメッシュの組を先に求めて通知し、その組だけを元の解像度で判定する
+    # 代理メッシュの頂点は元の位置から error 以内にあるので、距離が両方の error の和以下の組を重なりの候補とする
+    # 元の解像度のBVHは候補に残ったメッシュだけ作成し、(判定結果, BVHのリスト) を返す
+    def progressive_search(self, meshes, bvhs=None, monitor=None, profile=None):
+        result = OverlapResult([mesh.name for mesh in meshes], "Progressive", profile)
+        profile = result.profile
+        bvhs = list(bvhs) if bvhs is not None else [None] * len(meshes)
+        proxies = self.get_proxies(meshes, monitor, profile)
+        max_error = max([error for _, error in proxies] or [0.0])
+        candidate_pairs = self.get_candidate_pairs([bvh for bvh, _ in proxies], result, 2.0 * max_error)
+        coarse_pairs = []
+        for i, j in candidate_pairs.tolist():
+            (bvh1, error1), (bvh2, error2) = proxies[i], proxies[j]
+            # 代理メッシュ同士が交差していればすぐに候補とし、そうでなければ頂点が動いた距離まで広げて確認する
+            # 代理メッシュが空の場合は判定できないので候補に残す
+            with profile.stage("coarse phase"):
+                if (not bvh1.num_triangles or not bvh2.num_triangles
+                        or len(intersecting_triangle_pairs(bvh1, bvh2)[0])
+                        or any_within_distance(bvh1, bvh2, error1 + error2)):
+                    coarse_pairs.append((i, j))
+            if monitor is not None:
+                monitor.check_cancelled()
+        profile.count("coarse pairs", len(coarse_pairs))
+        profile.trace(f"coarse pairs: {coarse_pairs}")
+        result.coarse_pairs = coarse_pairs
+        if monitor is not None:
+            monitor.coarse_done(coarse_pairs)
+        indices = sorted(set(index for pair in coarse_pairs for index in pair))
+        built = self.build_missing_bvhs(
+            [meshes[index] for index in indices], [bvhs[index] for index in indices], monitor, profile)
+        for index, bvh in zip(indices, built):
+            bvhs[index] = bvh
+        self.exact_search(bvhs, coarse_pairs, result, monitor)
+        return result, bvhs
+
+    # 指定した距離より近いフェースと、フェースごとの最短距離を求める
+    def clearance_search(self, bvhs, result, monitor=None, clearance=None):
+        profile = result.profile
+        clearance = self.clearance if clearance is None else clearance
+        candidate_pairs = self.get_candidate_pairs(bvhs, result, clearance)
+        for done, (i, j) in enumerate(candidate_pairs, 1):
+            with profile.stage("distance queries"):
+                faces1, distances1, faces2, distances2 = faces_within_distance(bvhs[i], bvhs[j], clearance)
+            profile.count("pairs evaluated")
+            profile.trace(f"pair {i} {j}: {len(faces1)} / {len(faces2)} faces within {clearance}")
+            if len(faces1) or len(faces2):
+                result.add_pair(i, j, faces1, faces2)
+                result.pair_distances[(int(i), int(j))] = (distances1, distances2)
+            if monitor is not None:
+                monitor.pair_done(done, len(candidate_pairs), i, j, faces1, faces2)
+        return result
+
+    # フレームごとの頂点座標 [(フレーム, メッシュごとの頂点座標), ...] で衝突判定を行い、タイムラインを返す
+    # BVHは最初に一度だけ作成し、以降のフレームでは頂点座標が変わったメッシュだけ再フィットする
+    # 前のフレームと合わせたバウンディングボックスが重なるペアのうち、どちらかが動いたペアだけを再判定する
+    def scan_frames(self, meshes, frame_points, monitor=None, profile=None):
+        timeline = OverlapTimeline([mesh.name for mesh in meshes], profile)
+        profile = timeline.profile
+        # キャッシュのBVHを書き換えないように、フレーム範囲用のBVHをワールド空間で作成する
+        bvhs = self.build_missing_bvhs(meshes, None, monitor, profile, share_instances=False)
+        num_frames = len(frame_points) if hasattr(frame_points, "__len__") else 0
+        previous_bounds = [bvh.bounds for bvh in bvhs]
+        previous_pairs = {}
+        for done, (frame, points_list) in enumerate(frame_points, 1):
+            timeline.add_frame(frame)
+            moved = []
+            for index, points in enumerate(points_list):
+                # フェース構成が変わったフレームは MeshArrays で渡されるので、refit せずにBVHを作り直す
+                # (頂点数が同じでもつながりが変わっていれば前の三角形分割は使えない)
+                if isinstance(points, MeshArrays):
+                    with profile.stage("bvh build"):
+                        bvhs[index] = MeshBVH.from_polygons(points.points, points.face_counts, points.face_connects)
+                    profile.count("rebuilds")
+                    moved.append(True)
+                    continue
+                points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+                if np.array_equal(points, bvhs[index].points):
+                    moved.append(False)
+                    continue
+                with profile.stage("refit"):
+                    bvhs[index].refit(points)
+                profile.count("refits")
+                moved.append(True)
+
+            # 前のフレームからの移動範囲を含むバウンディングボックスで候補のペアを絞り込む
+            bounds = [bvh.bounds for bvh in bvhs]
+            with profile.stage("broad phase"):
+                candidate_pairs, culled_pairs = sweep_and_prune(
+                    [np.minimum(b0[0], b1[0]) for b0, b1 in zip(previous_bounds, bounds)],
+                    [np.maximum(b0[1], b1[1]) for b0, b1 in zip(previous_bounds, bounds)],
+                )
+            profile.count("pairs culled", culled_pairs)
+            current_pairs = {}
+            for i, j in candidate_pairs.tolist():
+                faces = previous_pairs.get((i, j))
+                if faces is None or moved[i] or moved[j]:
+                    with profile.stage("narrow phase"):
+                        faces = intersecting_faces(bvhs[i], bvhs[j])
+                    profile.count("pairs evaluated")
+                else:
+                    profile.count("pairs reused")
+                current_pairs[(i, j)] = faces
+                if len(faces[0]) or len(faces[1]):
+                    timeline.add_frame_pair(frame, i, j, *faces)
+            profile.trace(f"frame {frame}: {len(timeline.frame_pairs[frame])} overlapping pairs")
+            previous_pairs = current_pairs
+            previous_bounds = bounds
+            if monitor is not None:
+                monitor.progress(done, num_frames)
+        return timeline
+
+    # メッシュごとに自己交差しているフェースを求める
+    # 自己交差は配置によらないので、同じBVHを共有するインスタンスは一度だけ判定する
+    def self_search(self, bvhs, result, monitor=None):
+        profile = result.profile
+        shared_faces = {}
+        for done, bvh in enumerate(bvhs, 1):
+            index = done - 1
+            local_bvh = local_frame(bvh)[0]
+            faces = shared_faces.get(id(local_bvh))
+            if faces is None:
+                with profile.stage("self intersection"):
+                    faces = self_intersecting_faces(local_bvh)
+                shared_faces[id(local_bvh)] = faces
+                profile.count("meshes evaluated")
+            else:
+                profile.count("meshes reused")
+            profile.trace(f"mesh {index}: {len(faces)} faces")
+            if len(faces):
+                result.add_pair(index, index, faces)
+            if monitor is not None:
+                monitor.pair_done(done, len(bvhs), index, index, faces)
+        return result
+
+    # 表面のボクセルの重なりから交差しているフェースを求め、めり込んでいる体積も求める
+    def voxel_search(self, bvhs, candidate_pairs, result, monitor=None, voxel_size=None):
+        profile = result.profile
+        voxel_size = voxel_size or self.voxel_size
+        for done, (i, j) in enumerate(candidate_pairs, 1):
+            # ボクセル化と体積の計算はペアのバウンディングボックスの重なりの内側だけで行う
+            bounds = intersect_bounds(bvhs[i].bounds, bvhs[j].bounds)
+            faces1 = faces2 = np.zeros(0, dtype=np.int64)
+            volume = None
+            if bounds is not None:
+                # 大きな地面などと小さなメッシュのペアでも細かくなるよう、重なりの大きさから一辺を決める
+                pair_voxel_size = voxel_size or default_voxel_size([bounds])
+                num_cells = max(surface_cell_count(bvhs[i], pair_voxel_size, bounds),
+                                surface_cell_count(bvhs[j], pair_voxel_size, bounds),
+                                cell_count(bounds[0], bounds[1], pair_voxel_size))
+                profile.trace(f"pair {i} {j}: voxel size {pair_voxel_size}, {num_cells} cells")
+                if num_cells > MAX_VOXEL_CELLS:
+                    # セルが多すぎる場合は三角形同士の交差判定に切り替える (体積は求めない)
+                    with profile.stage("narrow phase"):
+                        faces1, faces2 = intersecting_faces(bvhs[i], bvhs[j])
+                    profile.count("voxel fallbacks")
+                else:
+                    with profile.stage("voxelization"):
+                        voxels1 = SurfaceVoxels(bvhs[i], pair_voxel_size, bounds)
+                        voxels2 = SurfaceVoxels(bvhs[j], pair_voxel_size, bounds)
+                    profile.count("surface voxels", len(voxels1) + len(voxels2))
+                    with profile.stage("voxel refinement"):
+                        faces1, faces2 = refine_shared_voxels(bvhs[i], bvhs[j], voxels1, voxels2)
+                    with profile.stage("voxel volume"):
+                        volume = overlap_volume(bvhs[i], bvhs[j], pair_voxel_size)
+            profile.count("pairs evaluated")
+            profile.trace(f"pair {i} {j}: {len(faces1)} / {len(faces2)} faces, volume {volume}")
+            # 一方が他方に完全に含まれる場合はフェースが交差しないが、体積があれば重なりとする
+            if len(faces1) or len(faces2) or volume:
+                result.add_pair(i, j, faces1, faces2)
+                if volume is not None:
+                    result.pair_volumes[(int(i), int(j))] = volume
+            if monitor is not None:
+                monitor.pair_done(done, len(candidate_pairs), i, j, faces1, faces2)
+        return result
+
+    # 変更されたメッシュを含むペアの前回の結果を破棄
+    def invalidate_pairs(self, changed_keys):
+        changed_keys = set(changed_keys)
+        for pair_key in [pair_key for pair_key in self.pair_results if changed_keys.intersection(pair_key)]:
+            del self.pair_results[pair_key]
+
+    # 変更されたメッシュを含むペアだけを三角形同士の交差判定で再計算し、前回の結果とまとめる
+    def search_incremental(self, keys, meshes, bvhs=None, changed_keys=(), monitor=None, profile=None):
+        self.invalidate_pairs(changed_keys)
+        result = OverlapResult([mesh.name for mesh in meshes], "Exact", profile)
+        profile = result.profile
+        bvhs = self.build_missing_bvhs(meshes, bvhs, monitor, profile)
+        candidate_pairs = self.get_candidate_pairs(bvhs, result)
+        for done, (i, j) in enumerate(candidate_pairs, 1):
+            # キーの順序をそろえて前回の結果を探す
+            swapped = keys[i] > keys[j]
+            pair_key = (keys[j], keys[i]) if swapped else (keys[i], keys[j])
+            faces = self.pair_results.get(pair_key)
+            if faces is None:
+                with profile.stage("narrow phase"):
+                    faces1, faces2 = intersecting_faces(bvhs[i], bvhs[j])
+                self.pair_results[pair_key] = (faces2, faces1) if swapped else (faces1, faces2)
+                result.evaluated_pairs += 1
+                profile.count("pairs evaluated")
+                profile.trace(f"pair {keys[i]} {keys[j]}: {len(faces1)} / {len(faces2)} faces")
+            else:
+                faces1, faces2 = (faces[1], faces[0]) if swapped else faces
+                result.reused_pairs += 1
+                profile.count("pairs reused")
+            if len(faces1) or len(faces2):
+                result.add_pair(i, j, faces1, faces2)
+            if monitor is not None:
+                monitor.pair_done(done, len(candidate_pairs), i, j, faces1, faces2)
+        return result
+
+    # 他方のメッシュの内部にあるフェース中心をまとめて取得
+    def get_inside_face_centers(self, mesh, other_bvh, containment=None):
+        containment = containment or self.containment
+        face_centers = mesh.face_centers()
+        face_normals = mesh.face_normals()
+        # 面の法線方向に沿ってレイの開始点を調整し、法線の逆方向にレイを飛ばす
+        ray_origins = face_centers + 0.001 * face_normals
+        if containment == "Winding Number":
+            # 巻き数の絶対値が 0.5 を超える場合は内部とする (開いたメッシュや法線の向きにも対応)
+            winding = other_bvh.winding_numbers(ray_origins)
+            return face_centers[np.abs(winding) > 0.5]
+        crossings = other_bvh.count_crossings(ray_origins, -face_normals, 99999)
+        # 交差回数が奇数の場合他方のメッシュ内部で衝突したとする
+        return face_centers[crossings % 2 != 0]
+
+    # 複数のオブジェクトのメッシュの内部にあるサンプルポイントを生成
+    def generate_sample_points(self, meshes, bvhs, candidate_pairs, result=None, monitor=None, containment=None):
+        containment = containment or self.containment
+        profile = result.profile if result is not None else SearchProfile()
+        inside_point = VoxelPointSet(self.tolerance)
+        for done, (i, j) in enumerate(candidate_pairs, 1):
+            # 他方のメッシュの内部に存在する頂点の取得
+            with profile.stage("inside tests"):
+                added = self.point_inside_mesh(meshes[i], meshes[j], bvhs[i], bvhs[j], inside_point, containment)
+            num_queries = meshes[i].num_faces + meshes[j].num_faces
+            profile.count("winding queries" if containment == "Winding Number" else "rays cast", num_queries)
+            profile.trace(f"pair {i} {j}: {added} inside points")
+            if added and result is not None:
+                result.add_pair(i, j)
+            if monitor is not None:
+                monitor.pair_done(done, len(candidate_pairs), i, j)
+
+        # ランダムな異なる2つの点を選択して中点を生成
+        points = inside_point.points
+        profile.count("inside points", len(points))
+        num_samples = len(points) // 2
+        profile.count("sample points", num_samples)
+        if not num_samples:
+            return np.zeros((0, 3))
+        rng = np.random.default_rng(self.seed)
+        first = rng.integers(len(points), size=num_samples)
+        second = (first + rng.integers(1, len(points), size=num_samples)) % len(points)
+        return (points[first] + points[second]) / 2
+
+    # 他方のメッシュの内部にあるフェース中心を集め、追加した点の数を返す
+    def point_inside_mesh(self, mesh1, mesh2, bvh1, bvh2, inside_point, containment=None):
+        # 両方の境界ボックスの共通部分をペアごとに一度だけ求める
+        bounds = intersect_bounds(bvh1.bounds, bvh2.bounds)
+        if bounds is None:
+            return 0
+        # メッシュ1の各面の中心座標からレイキャストを行い、メッシュ2の内部にある点を取得
+        # メッシュ2の各面についても同様にメッシュ1の内部にある点を取得
+        centers = np.concatenate([
+            self.get_inside_face_centers(mesh1, bvh2, containment),
+            self.get_inside_face_centers(mesh2, bvh1, containment),
+        ])
+        # メッシュ1とメッシュ2の両方の境界ボックス内にある点を残す
+        return inside_point.add(centers[points_inside_bounds(centers, *bounds)])
+
+    # 各サンプルポイントから6方向にレイを飛ばし、最初に当たるフェース番号を (サンプル数, 6) で返す
+    def sample_point_ray_cast(self, bvh, sample_points):
+        sample_points = np.asarray(sample_points, dtype=np.float64).reshape(-1, 3)
+        ray_origins = np.repeat(sample_points, len(RAY_DIRECTIONS), axis=0)
+        ray_directions = np.tile(RAY_DIRECTIONS, (len(sample_points), 1))
+        hit_faces, _ = bvh.first_hits(ray_origins, ray_directions, 99999)
+        return hit_faces.reshape(-1, len(RAY_DIRECTIONS))
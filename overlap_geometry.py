@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import queue
+
+import numpy as np
+
+
+# メッシュの頂点座標とフェース構成を保持する配列
+class MeshArrays(object):
+
+    def __init__(self, points, face_counts, face_connects, name=""):
+        points = np.asarray(points, dtype=np.float64)
+        self.points = points.reshape(len(points), -1)[:, :3] if len(points) else np.zeros((0, 3))
+        self.face_counts = np.asarray(face_counts, dtype=np.int64)
+        self.face_connects = np.asarray(face_connects, dtype=np.int64)
+        self.face_offsets = np.cumsum(self.face_counts) - self.face_counts
+        self.name = name
+        self._face_centers = None
+        self._face_normals = None
+
+    # MFnMeshから頂点とフェース構成を一括で取得
+    @classmethod
+    def from_mesh_fn(cls, item_mesh_fn, space=None):
+        if space is None:
+            from maya.api import OpenMaya as om2
+            space = om2.MSpace.kWorld
+        points = np.array(item_mesh_fn.getPoints(space), dtype=np.float64).reshape(-1, 4)
+        face_counts, face_connects = item_mesh_fn.getVertices()
+        return cls(points[:, :3], np.array(face_counts, dtype=np.int64),
+                   np.array(face_connects, dtype=np.int64), name=item_mesh_fn.name())
+
+    @property
+    def num_faces(self):
+        return len(self.face_counts)
+
+    @property
+    def num_vertices(self):
+        return len(self.points)
+
+    # 頂点座標のバウンディングボックス (min, max)
+    @property
+    def bounds(self):
+        if not len(self.points):
+            return np.zeros(3), np.zeros(3)
+        return self.points.min(axis=0), self.points.max(axis=0)
+
+    # フェースごとの頂点インデックス
+    def face_vertices(self, face_index):
+        start = self.face_offsets[face_index]
+        return self.face_connects[start:start + self.face_counts[face_index]]
+
+    # 全フェースの中心座標 (頂点の平均)
+    def face_centers(self):
+        if self._face_centers is None:
+            centers = np.zeros((self.num_faces, 3))
+            valid = self.face_counts > 0
+            if valid.any():
+                sums = np.add.reduceat(self.points[self.face_connects], self.face_offsets[valid], axis=0)
+                centers[valid] = sums / self.face_counts[valid, None]
+            self._face_centers = centers
+        return self._face_centers
+
+    # 全フェースの法線 (Newell法で求めて正規化)
+    def face_normals(self):
+        if self._face_normals is None:
+            normals = np.zeros((self.num_faces, 3))
+            valid = self.face_counts > 0
+            if valid.any():
+                # フェース内で次の頂点のインデックスを求める
+                corner_faces = np.repeat(np.arange(self.num_faces), self.face_counts)
+                local = np.arange(len(self.face_connects)) - self.face_offsets[corner_faces]
+                next_corner = self.face_offsets[corner_faces] + (local + 1) % self.face_counts[corner_faces]
+                current = self.points[self.face_connects]
+                following = self.points[self.face_connects[next_corner]]
+                crosses = np.cross(current, following)
+                normals[valid] = np.add.reduceat(crosses, self.face_offsets[valid], axis=0)
+                lengths = np.linalg.norm(normals, axis=1)
+                nonzero = lengths > 0.0
+                normals[nonzero] /= lengths[nonzero, None]
+            self._face_normals = normals
+        return self._face_normals
+
+
+# MFnMeshのフェース構成 (フェースごとの頂点数, 頂点番号) を配列で取得
+def face_layout(item_mesh_fn):
+    face_counts, face_connects = item_mesh_fn.getVertices()
+    return np.array(face_counts, dtype=np.int64), np.array(face_connects, dtype=np.int64)
+
+
+# フレームごとにワールド空間の頂点座標を取得し、(フレーム, メッシュごとの頂点座標のリスト) を返す
+# フェース構成が前のフレームから変わったメッシュは、頂点数が同じでもフェース構成を含めた MeshArrays を返す
+# 取得が終わったら元のフレームに戻す
+def sample_frame_points(item_mesh_fns, frames):
+    import maya.cmds as cmds
+    from maya.api import OpenMaya as om2
+    current_time = cmds.currentTime(query=True)
+    layouts = [face_layout(item_mesh_fn) for item_mesh_fn in item_mesh_fns]
+    try:
+        for frame in frames:
+            cmds.currentTime(frame, update=True)
+            points_list = []
+            for index, item_mesh_fn in enumerate(item_mesh_fns):
+                points = np.array(item_mesh_fn.getPoints(om2.MSpace.kWorld), dtype=np.float64).reshape(-1, 4)[:, :3]
+                face_counts, face_connects = face_layout(item_mesh_fn)
+                previous_counts, previous_connects = layouts[index]
+                if np.array_equal(face_counts, previous_counts) and np.array_equal(face_connects, previous_connects):
+                    points_list.append(points)
+                    continue
+                layouts[index] = (face_counts, face_connects)
+                points_list.append(MeshArrays(points, face_counts, face_connects, name=item_mesh_fn.name()))
+            yield frame, points_list
+    finally:
+        cmds.currentTime(current_time, update=True)
+
+
+# 取得したフレームを少しずつ判定スレッドに渡すキュー
+# メインスレッドで put し、判定スレッドでは sample_frame_points と同じように for 文で取り出す (close まで待つ)
+class FrameQueue(object):
+
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+        self._queue = queue.Queue()
+
+    def __len__(self):
+        return self.num_frames
+
+    # 判定スレッドがまだ取り出していないフレーム数
+    def pending(self):
+        return self._queue.qsize()
+
+    def put(self, frame, points_list):
+        self._queue.put((frame, points_list))
+
+    # 取り出しを終了する (error を指定した場合は取り出し側でその例外を送出する)
+    def close(self, error=None):
+        self._queue.put(error)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
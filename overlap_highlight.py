@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+
+# インデックスを連続した範囲 (start, end) のリストにまとめる
+def compress_index_ranges(indices):
+    indices = np.unique(np.asarray(list(indices), dtype=np.int64))
+    if not len(indices):
+        return []
+    breaks = np.nonzero(np.diff(indices) != 1)[0]
+    starts = np.concatenate([indices[:1], indices[breaks + 1]])
+    ends = np.concatenate([indices[breaks], indices[-1:]])
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+# "mesh.f[10:250]" 形式のコンポーネント名のリストを作成
+def component_names(node_name, indices, component="f"):
+    names = []
+    for start, end in compress_index_ranges(indices):
+        if start == end:
+            names.append(f"{node_name}.{component}[{start}]")
+        else:
+            names.append(f"{node_name}.{component}[{start}:{end}]")
+    return names
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+from overlap_bvh import WINDING_ACCURACY, transform_bounds, transform_points
+
+
+# MMatrixを4x4のnumpy配列に変換
+def matrix_from_mmatrix(mmatrix):
+    return np.array([mmatrix[i] for i in range(16)], dtype=np.float64).reshape(4, 4)
+
+
+# 行列をnumpy配列にする (None の場合は単位行列)
+def as_matrix(matrix):
+    if matrix is None:
+        return np.identity(4)
+    return np.asarray(matrix, dtype=np.float64).reshape(4, 4)
+
+
+# オブジェクト空間のメッシュを共有し、ワールド行列で配置したもの
+# インスタンスや複製ごとに頂点配列を持たず、MeshArraysと同じ値をワールド空間で返す
+class InstancedMesh(object):
+
+    def __init__(self, mesh, matrix=None, name=""):
+        self.mesh = mesh
+        self.matrix = as_matrix(matrix)
+        self.inverse = np.linalg.inv(self.matrix)
+        self.name = name or mesh.name
+
+    @property
+    def face_counts(self):
+        return self.mesh.face_counts
+
+    @property
+    def face_connects(self):
+        return self.mesh.face_connects
+
+    @property
+    def face_offsets(self):
+        return self.mesh.face_offsets
+
+    @property
+    def num_faces(self):
+        return self.mesh.num_faces
+
+    @property
+    def num_vertices(self):
+        return self.mesh.num_vertices
+
+    # ワールド空間の頂点座標 (参照するたびに変換する)
+    @property
+    def points(self):
+        return transform_points(self.mesh.points, self.matrix)
+
+    # オブジェクト空間のバウンディングボックスを変換したもの
+    @property
+    def bounds(self):
+        bounds_min, bounds_max = self.mesh.bounds
+        return transform_bounds(bounds_min, bounds_max, self.matrix)
+
+    def face_vertices(self, face_index):
+        return self.mesh.face_vertices(face_index)
+
+    def face_centers(self):
+        return transform_points(self.mesh.face_centers(), self.matrix)
+
+    # 法線は逆転置行列で変換する (反転を含む行列では頂点の並びが逆になるので向きも反転する)
+    def face_normals(self):
+        normals = np.dot(self.mesh.face_normals(), self.inverse[:3, :3].T)
+        if np.linalg.det(self.matrix[:3, :3]) < 0:
+            normals = -normals
+        lengths = np.linalg.norm(normals, axis=1)
+        nonzero = lengths > 0.0
+        normals[nonzero] /= lengths[nonzero, None]
+        return normals
+
+
+# オブジェクト空間のBVHを共有し、レイや点をオブジェクト空間に変換して判定する
+class InstancedBVH(object):
+
+    def __init__(self, bvh, matrix=None):
+        self.bvh = bvh
+        self.matrix = as_matrix(matrix)
+        self.inverse = np.linalg.inv(self.matrix)
+        self._orientation = -1.0 if np.linalg.det(self.matrix[:3, :3]) < 0 else 1.0
+
+    @property
+    def num_triangles(self):
+        return self.bvh.num_triangles
+
+    @property
+    def triangles(self):
+        return self.bvh.triangles
+
+    @property
+    def tri_faces(self):
+        return self.bvh.tri_faces
+
+    # オブジェクト空間のルートノードを変換したワールド空間のバウンディングボックス
+    @property
+    def bounds(self):
+        bounds_min, bounds_max = self.bvh.bounds
+        return transform_bounds(bounds_min, bounds_max, self.matrix)
+
+    def triangle_corners(self, tris):
+        corners = self.bvh.triangle_corners(tris)
+        return transform_points(corners.reshape(-1, 3), self.matrix).reshape(-1, 3, 3)
+
+    # レイをオブジェクト空間に変換 (アフィン変換なのでレイパラメータはそのまま使える)
+    def _to_local(self, origins, directions):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        return transform_points(origins, self.inverse), np.dot(directions, self.inverse[:3, :3])
+
+    def count_crossings(self, origins, directions, max_param=99999.0):
+        origins, directions = self._to_local(origins, directions)
+        return self.bvh.count_crossings(origins, directions, max_param)
+
+    def all_hits(self, origins, directions, max_param=99999.0):
+        origins, directions = self._to_local(origins, directions)
+        return self.bvh.all_hits(origins, directions, max_param)
+
+    def first_hits(self, origins, directions, max_param=99999.0):
+        origins, directions = self._to_local(origins, directions)
+        return self.bvh.first_hits(origins, directions, max_param)
+
+    # 巻き数はアフィン変換で変わらない (反転を含む場合だけ符号が変わる)
+    def winding_numbers(self, points, accuracy=WINDING_ACCURACY):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return self._orientation * self.bvh.winding_numbers(transform_points(points, self.inverse), accuracy)
+
+    # ワールド空間のボックスをオブジェクト空間に変換して探す (変換後のボックスは元より大きいので候補は漏れない)
+    def triangles_in_bounds(self, bounds_min, bounds_max):
+        return self.bvh.triangles_in_bounds(*transform_bounds(bounds_min, bounds_max, self.inverse))
+
+    # 自己交差の候補はオブジェクト空間で求めても同じ
+    def self_overlap_candidates(self):
+        return self.bvh.self_overlap_candidates()
+
+
+# 共有しているBVHとワールド行列を返す (通常のBVHの場合は行列は None)
+def local_frame(bvh):
+    if isinstance(bvh, InstancedBVH):
+        return bvh.bvh, bvh.matrix, bvh.inverse
+    return bvh, None, None
+
+
+# 2つのBVHのバウンディングボックスが重なる三角形の組を返す
+# インスタンスの場合は bvh_a のオブジェクト空間で走査する
+def pair_candidates(bvh_a, bvh_b, tolerance=0.0):
+    local_a, _, inverse_a = local_frame(bvh_a)
+    local_b, matrix_b, _ = local_frame(bvh_b)
+    if inverse_a is None and matrix_b is None:
+        return local_a.overlap_candidates(local_b, tolerance)
+    transform = as_matrix(matrix_b)
+    if inverse_a is not None:
+        transform = np.dot(transform, inverse_a)
+        # ワールド空間の距離をオブジェクト空間で最も伸びる方向に合わせる
+        tolerance = tolerance * float(np.linalg.norm(inverse_a[:3, :3], 2))
+    return local_a.overlap_candidates(local_b, tolerance, transform)
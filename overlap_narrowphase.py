@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+from overlap_bvh import INTERSECT_EPSILON
+from overlap_instance import pair_candidates
+
+# 一度に判定する三角形の組の数
+PAIR_CHUNK_SIZE = 1 << 18
+
+
+# 線分 (start, start + segment) と三角形 (v0, v0 + e1, v0 + e2) の交差をまとめて判定
+def segment_triangle_intersect(start, segment, v0, e1, e2):
+    pvec = np.cross(segment, e2)
+    det = np.einsum('ij,ij->i', e1, pvec)
+    valid = np.abs(det) > INTERSECT_EPSILON
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = np.where(valid, 1.0 / np.where(valid, det, 1.0), 0.0)
+        tvec = start - v0
+        u = np.einsum('ij,ij->i', tvec, pvec) * inv_det
+        qvec = np.cross(tvec, e1)
+        v = np.einsum('ij,ij->i', segment, qvec) * inv_det
+        t = np.einsum('ij,ij->i', e2, qvec) * inv_det
+    return valid & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t >= 0.0) & (t <= 1.0)
+
+
+# 三角形の組 (K, 3, 3) 同士が交差しているかをまとめて判定
+# どちらかの三角形の辺が他方の三角形を貫いていれば交差とする (同一平面上の接触は含めない)
+def triangle_pairs_intersect(tris_a, tris_b):
+    hit = np.zeros(len(tris_a), dtype=bool)
+    for first, second in ((tris_a, tris_b), (tris_b, tris_a)):
+        v0 = second[:, 0]
+        e1 = second[:, 1] - v0
+        e2 = second[:, 2] - v0
+        for k in range(3):
+            undecided = ~hit
+            if not undecided.any():
+                return hit
+            start = first[undecided, k]
+            segment = first[undecided, (k + 1) % 3] - start
+            hit[undecided] = segment_triangle_intersect(
+                start, segment, v0[undecided], e1[undecided], e2[undecided])
+    return hit
+
+
+# 点 (K, 3) から三角形 (v0, v0 + e1, v0 + e2) 上の最も近い点をまとめて求める
+def closest_points_on_triangles(points, v0, e1, e2):
+    ap = points - v0
+    d1 = np.einsum('ij,ij->i', e1, ap)
+    d2 = np.einsum('ij,ij->i', e2, ap)
+    bp = ap - e1
+    d3 = np.einsum('ij,ij->i', e1, bp)
+    d4 = np.einsum('ij,ij->i', e2, bp)
+    cp = ap - e2
+    d5 = np.einsum('ij,ij->i', e1, cp)
+    d6 = np.einsum('ij,ij->i', e2, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 三角形の内部に投影される場合
+        denom = va + vb + vc
+        v = np.where(denom != 0, vb / denom, 0.0)
+        w = np.where(denom != 0, vc / denom, 0.0)
+        closest = v0 + e1 * v[:, None] + e2 * w[:, None]
+        # 辺や頂点の領域は優先度の低いものから上書きする
+        in_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        closest[in_bc] = (v0 + e1 + (e2 - e1) * t[:, None])[in_bc]
+        in_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        t = d2 / (d2 - d6)
+        closest[in_ac] = (v0 + e2 * t[:, None])[in_ac]
+        in_c = (d6 >= 0) & (d5 <= d6)
+        closest[in_c] = (v0 + e2)[in_c]
+        in_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        t = d1 / (d1 - d3)
+        closest[in_ab] = (v0 + e1 * t[:, None])[in_ab]
+        in_b = (d3 >= 0) & (d4 <= d3)
+        closest[in_b] = (v0 + e1)[in_b]
+        in_a = (d1 <= 0) & (d2 <= 0)
+        closest[in_a] = v0[in_a]
+    return closest
+
+
+# 線分 (p1, p1 + d1) と (p2, p2 + d2) の最短距離をまとめて求める
+def segment_distances(p1, d1, p2, d2):
+    r = p1 - p2
+    a = np.einsum('ij,ij->i', d1, d1)
+    e = np.einsum('ij,ij->i', d2, d2)
+    f = np.einsum('ij,ij->i', d2, r)
+    c = np.einsum('ij,ij->i', d1, r)
+    b = np.einsum('ij,ij->i', d1, d2)
+    denom = a * e - b * b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 平行な場合は s = 0 から始める
+        s = np.clip(np.where(denom > INTERSECT_EPSILON, (b * f - c * e) / denom, 0.0), 0.0, 1.0)
+        t = np.where(e > INTERSECT_EPSILON, (b * s + f) / e, 0.0)
+        s = np.where(t < 0, np.clip(np.where(a > INTERSECT_EPSILON, -c / a, 0.0), 0.0, 1.0), s)
+        s = np.where(t > 1, np.clip(np.where(a > INTERSECT_EPSILON, (b - c) / a, 0.0), 0.0, 1.0), s)
+        t = np.clip(t, 0.0, 1.0)
+    return np.linalg.norm(p1 + d1 * s[:, None] - p2 - d2 * t[:, None], axis=1)
+
+
+# 三角形の組 (K, 3, 3) 同士の最短距離をまとめて求める (交差している場合は 0)
+# 頂点と三角形の距離 6 通りと辺同士の距離 9 通りの最小値を使う
+def triangle_pairs_distance(tris_a, tris_b):
+    distance = np.full(len(tris_a), np.inf)
+    for first, second in ((tris_a, tris_b), (tris_b, tris_a)):
+        v0 = second[:, 0]
+        e1 = second[:, 1] - v0
+        e2 = second[:, 2] - v0
+        for k in range(3):
+            closest = closest_points_on_triangles(first[:, k], v0, e1, e2)
+            distance = np.minimum(distance, np.linalg.norm(first[:, k] - closest, axis=1))
+    for k in range(3):
+        start_a = tris_a[:, k]
+        segment_a = tris_a[:, (k + 1) % 3] - start_a
+        for m in range(3):
+            start_b = tris_b[:, m]
+            segment_b = tris_b[:, (m + 1) % 3] - start_b
+            distance = np.minimum(distance, segment_distances(start_a, segment_a, start_b, segment_b))
+    distance[triangle_pairs_intersect(tris_a, tris_b)] = 0.0
+    return distance
+
+
+# インデックスごとに値の最小値を求める (インデックスは昇順で返す)
+def min_by_index(indices, values):
+    order = np.lexsort((values, indices))
+    indices, values = indices[order], values[order]
+    first = np.ones(len(indices), dtype=bool)
+    first[1:] = indices[1:] != indices[:-1]
+    return indices[first], values[first]
+
+
+# 2つのBVH (インスタンスを含む) 間で clearance 以下の距離にあるフェース番号と、フェースごとの最短距離を返す
+def faces_within_distance(bvh_a, bvh_b, clearance):
+    found_a, found_b, found_distance = [], [], []
+    for tris_a, tris_b in pair_candidates(bvh_a, bvh_b, clearance):
+        for begin in range(0, len(tris_a), PAIR_CHUNK_SIZE):
+            chunk_a = tris_a[begin:begin + PAIR_CHUNK_SIZE]
+            chunk_b = tris_b[begin:begin + PAIR_CHUNK_SIZE]
+            distance = triangle_pairs_distance(bvh_a.triangle_corners(chunk_a), bvh_b.triangle_corners(chunk_b))
+            near = distance <= clearance
+            found_a.append(chunk_a[near])
+            found_b.append(chunk_b[near])
+            found_distance.append(distance[near])
+    if not found_a:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0), empty, np.zeros(0)
+    distance = np.concatenate(found_distance)
+    faces_a, distance_a = min_by_index(bvh_a.tri_faces[np.concatenate(found_a)], distance)
+    faces_b, distance_b = min_by_index(bvh_b.tri_faces[np.concatenate(found_b)], distance)
+    return faces_a, distance_a, faces_b, distance_b
+
+
+# 2つのBVH間に distance 以下の距離の三角形の組が1つでもあるか (見つかった時点で打ち切る)
+def any_within_distance(bvh_a, bvh_b, distance):
+    for tris_a, tris_b in pair_candidates(bvh_a, bvh_b, distance):
+        for begin in range(0, len(tris_a), PAIR_CHUNK_SIZE):
+            chunk_a = tris_a[begin:begin + PAIR_CHUNK_SIZE]
+            chunk_b = tris_b[begin:begin + PAIR_CHUNK_SIZE]
+            if np.any(triangle_pairs_distance(bvh_a.triangle_corners(chunk_a),
+                                              bvh_b.triangle_corners(chunk_b)) <= distance):
+                return True
+    return False
+
+
+# 2つのBVH間で実際に交差している三角形の組 (BVH内の三角形番号) を返す
+def intersecting_triangle_pairs(bvh_a, bvh_b):
+    found_a = []
+    found_b = []
+    for tris_a, tris_b in pair_candidates(bvh_a, bvh_b):
+        for begin in range(0, len(tris_a), PAIR_CHUNK_SIZE):
+            chunk_a = tris_a[begin:begin + PAIR_CHUNK_SIZE]
+            chunk_b = tris_b[begin:begin + PAIR_CHUNK_SIZE]
+            hit = triangle_pairs_intersect(bvh_a.triangle_corners(chunk_a), bvh_b.triangle_corners(chunk_b))
+            found_a.append(chunk_a[hit])
+            found_b.append(chunk_b[hit])
+    if not found_a:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(found_a), np.concatenate(found_b)
+
+
+# 2つのメッシュで交差しているフェース番号をそれぞれ返す
+def intersecting_faces(bvh_a, bvh_b):
+    tris_a, tris_b = intersecting_triangle_pairs(bvh_a, bvh_b)
+    return np.unique(bvh_a.tri_faces[tris_a]), np.unique(bvh_b.tri_faces[tris_b])
+
+
+# 1つのBVH内で実際に交差している三角形の組を返す (頂点を共有する隣接した三角形は判定しない)
+def self_intersecting_triangle_pairs(bvh):
+    found_a = [np.zeros(0, dtype=np.int64)]
+    found_b = [np.zeros(0, dtype=np.int64)]
+    for tris_a, tris_b in bvh.self_overlap_candidates():
+        corners_a = bvh.triangles[tris_a]
+        corners_b = bvh.triangles[tris_b]
+        shared = np.any(corners_a[:, :, None] == corners_b[:, None, :], axis=(1, 2))
+        tris_a, tris_b = tris_a[~shared], tris_b[~shared]
+        for begin in range(0, len(tris_a), PAIR_CHUNK_SIZE):
+            chunk_a = tris_a[begin:begin + PAIR_CHUNK_SIZE]
+            chunk_b = tris_b[begin:begin + PAIR_CHUNK_SIZE]
+            hit = triangle_pairs_intersect(bvh.triangle_corners(chunk_a), bvh.triangle_corners(chunk_b))
+            found_a.append(chunk_a[hit])
+            found_b.append(chunk_b[hit])
+    return np.concatenate(found_a), np.concatenate(found_b)
+
+
+# 1つのメッシュ内で他のフェースと交差しているフェース番号を返す
+def self_intersecting_faces(bvh):
+    tris_a, tris_b = self_intersecting_triangle_pairs(bvh)
+    return np.unique(bvh.tri_faces[np.concatenate([tris_a, tris_b])])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+# 同じ点とみなす距離 (ボクセルの一辺の長さ)
+DEFAULT_TOLERANCE = 1e-6
+
+
+# 点がバウンディングボックス内にあるかをまとめて判定
+def points_inside_bounds(points, bounds_min, bounds_max):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return np.all((points >= bounds_min) & (points <= bounds_max), axis=1)
+
+
+# 2つのバウンディングボックスの共通部分 (重ならない場合は None)
+def intersect_bounds(bounds1, bounds2):
+    bounds_min = np.maximum(bounds1[0], bounds2[0])
+    bounds_max = np.minimum(bounds1[1], bounds2[1])
+    if np.any(bounds_min > bounds_max):
+        return None
+    return bounds_min, bounds_max
+
+
+# ボクセルの座標をキーにして重複を取り除く点の集合
+# 追加時は配列を貯めておき、点を参照するときに一度だけまとめて重複を取り除く
+class VoxelPointSet(object):
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE):
+        self.tolerance = tolerance
+        self._chunks = []
+        self._points = np.zeros((0, 3))
+
+    def __len__(self):
+        return len(self.points)
+
+    # 重複を取り除いた点 (N, 3)
+    @property
+    def points(self):
+        if self._chunks:
+            points = np.concatenate([self._points] + self._chunks)
+            self._chunks = []
+            _, first = np.unique(self._voxel_keys(points), return_index=True)
+            self._points = points[np.sort(first)]
+        return self._points
+
+    # 点をボクセルのキーに変換 (3つの整数をまとめて1つの値として比較できるようにする)
+    def _voxel_keys(self, points):
+        cells = np.floor(points / self.tolerance).astype(np.int64)
+        return np.ascontiguousarray(cells).view(np.dtype((np.void, 24))).ravel()
+
+    # 点を追加
+    def add(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points):
+            self._chunks.append(points)
+        return len(points)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import io
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# 判定の段階ごとの処理時間とカウンタを記録する
+# trace_path を指定した場合だけ、詳細なログをファイルに書き出す
+class SearchProfile(object):
+
+    def __init__(self, trace_path=None):
+        # 段階名 -> 合計時間 (秒)
+        self.stages = OrderedDict()
+        # カウンタ名 -> 値
+        self.counters = OrderedDict()
+        self.trace_path = trace_path
+        self._trace_file = None
+        # UIのスレッドと判定スレッドの両方から書き込むのでロックする
+        self._lock = threading.Lock()
+
+    # with文の間の処理時間を段階ごとに加算
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.trace(f"{name}: {seconds:.4f} s")
+
+    # カウンタを加算
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    @property
+    def tracing(self):
+        return bool(self.trace_path)
+
+    # 詳細ログをファイルに追記 (trace_path が未指定の場合は何もしない)
+    def trace(self, message):
+        if not self.trace_path:
+            return
+        with self._lock:
+            if self._trace_file is None:
+                self._trace_file = io.open(self.trace_path, "a", encoding="utf-8")
+            self._trace_file.write(f"{time.strftime('%H:%M:%S')} {message}\n")
+
+    def close(self):
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+    # Info Editorに表示する集計結果
+    def summary_lines(self):
+        lines = [f"{name}: {seconds:.3f} s" for name, seconds in self.stages.items()]
+        lines.extend(f"{name}: {value}" for name, value in self.counters.items())
+        return lines
+
+    # レポート出力用の辞書に変換
+    def to_dict(self):
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+from overlap_bvh import MeshBVH, triangulate_faces
+from overlap_geometry import MeshArrays
+
+# 代理メッシュの解像度 (バウンディングボックスの各軸を何個のセルに分けるか)
+PROXY_RESOLUTION = 16
+
+
+# 頂点をグリッドのセルごとに1つにまとめて三角形メッシュを減らし、(代理メッシュ, 頂点が動いた距離の上限) を返す
+# 細長いメッシュでも断面がつぶれにくいよう、セルの大きさは軸ごとに決める
+# 縮退した三角形も線分や点として残すので、元の表面上の点は必ず代理メッシュから上限以内の距離にある
+def decimate_mesh(mesh, resolution=PROXY_RESOLUTION):
+    triangles, _ = triangulate_faces(mesh.face_counts, mesh.face_connects)
+    if not len(triangles):
+        return MeshArrays(mesh.points, [], [], name=mesh.name), 0.0
+    bounds_min, bounds_max = mesh.bounds
+    extent = bounds_max - bounds_min
+    cell_size = np.where(extent > 0, extent / resolution, 1.0)
+    cells = np.floor((mesh.points - bounds_min) / cell_size).astype(np.int64)
+    _, clusters, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    clusters = clusters.ravel()
+    points = np.zeros((len(counts), 3))
+    np.add.at(points, clusters, mesh.points)
+    points /= counts[:, None]
+    # 代理メッシュは距離と交差の判定にしか使わないので、頂点の並びを揃えて向きを無視して重複を取り除く
+    triangles = np.unique(np.sort(clusters[triangles], axis=1), axis=0)
+    proxy = MeshArrays(points, np.full(len(triangles), 3), triangles.ravel(), name=mesh.name)
+    # セル内の頂点の平均に動かすので、移動距離はセルの対角線以下になる
+    return proxy, float(np.linalg.norm(mesh.points - points[clusters], axis=1).max())
+
+
+# 粗い判定に使う代理メッシュとそのBVH
+class MeshProxy(object):
+
+    def __init__(self, mesh, resolution=PROXY_RESOLUTION):
+        self.mesh, self.error = decimate_mesh(mesh, resolution)
+        self.bvh = MeshBVH.from_polygons(self.mesh.points, self.mesh.face_counts, self.mesh.face_connects)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+
+from overlap_narrowphase import PAIR_CHUNK_SIZE, triangle_pairs_intersect
+from overlap_pointset import intersect_bounds
+
+# ボクセルの一辺を指定しない場合に、メッシュの大きさを何分割するか
+DEFAULT_VOXEL_RESOLUTION = 32
+# セル座標を1つの整数にまとめるときの1軸あたりのビット数
+CELL_KEY_BITS = 21
+CELL_KEY_OFFSET = 1 << (CELL_KEY_BITS - 1)
+# 1つのペアで列挙するセルの数の上限 (超える場合は三角形同士の交差判定に切り替える)
+MAX_VOXEL_CELLS = 1 << 21
+
+
+# バウンディングボックスの大きさの中央値からボクセルの一辺を決める
+def default_voxel_size(bounds_list, resolution=DEFAULT_VOXEL_RESOLUTION):
+    extents = [float(np.max(bounds_max - bounds_min)) for bounds_min, bounds_max in bounds_list]
+    extents = [extent for extent in extents if extent > 0]
+    if not extents:
+        return 1.0
+    return float(np.median(extents)) / resolution
+
+
+# セル座標 (N, 3) を整数のキーに変換
+def cell_keys(cells):
+    cells = np.asarray(cells, dtype=np.int64) + CELL_KEY_OFFSET
+    return (cells[:, 0] << (2 * CELL_KEY_BITS)) | (cells[:, 1] << CELL_KEY_BITS) | cells[:, 2]
+
+
+# バウンディングボックスに含まれるセルの数
+def cell_count(bounds_min, bounds_max, voxel_size):
+    lo = np.floor(np.asarray(bounds_min) / voxel_size)
+    hi = np.floor(np.asarray(bounds_max) / voxel_size)
+    return int(np.prod(hi - lo + 1))
+
+
+# バウンディングボックスに含まれるセル座標をすべて列挙
+def cells_in_bounds(bounds_min, bounds_max, voxel_size):
+    lo = np.floor(np.asarray(bounds_min) / voxel_size).astype(np.int64)
+    hi = np.floor(np.asarray(bounds_max) / voxel_size).astype(np.int64)
+    axes = [np.arange(lo[axis], hi[axis] + 1) for axis in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+# 範囲 (start, count) の組ごとに、要素の全組み合わせのインデックスを作成
+def range_products(starts_a, counts_a, starts_b, counts_b):
+    pair_counts = counts_a * counts_b
+    total = int(pair_counts.sum())
+    local = np.arange(total) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+    width = np.repeat(counts_b, pair_counts)
+    return (np.repeat(starts_a, pair_counts) + local // width,
+            np.repeat(starts_b, pair_counts) + local % width)
+
+
+# バウンディングボックス (min, max) と重なる三角形の番号と頂点座標、
+# ボックスで切り取った三角形のバウンディングボックスに含まれるセル座標の範囲 (lo, hi) を返す
+def triangle_cell_ranges(bvh, voxel_size, bounds):
+    tris = bvh.triangles_in_bounds(bounds[0], bounds[1])
+    corners = bvh.triangle_corners(tris)
+    tri_min = np.maximum(corners.min(axis=1), bounds[0])
+    tri_max = np.minimum(corners.max(axis=1), bounds[1])
+    # インスタンスのBVHはオブジェクト空間で探すので、ワールド空間で重ならない三角形も含まれる
+    keep = np.all(tri_min <= tri_max, axis=1)
+    lo = np.floor(tri_min[keep] / voxel_size).astype(np.int64)
+    hi = np.floor(tri_max[keep] / voxel_size).astype(np.int64)
+    return tris[keep], corners[keep], lo, hi
+
+
+# 三角形ごとのセルの範囲を列挙したときのセルの数
+def surface_cell_count(bvh, voxel_size, bounds):
+    _, _, lo, hi = triangle_cell_ranges(bvh, voxel_size, bounds)
+    return int((hi - lo + 1).prod(axis=1).sum())
+
+
+# メッシュの表面が通るボクセルの疎な集合 (バウンディングボックス bounds の内側だけを求める)
+class SurfaceVoxels(object):
+
+    def __init__(self, bvh, voxel_size, bounds):
+        self.voxel_size = float(voxel_size)
+        # (キー, BVH内の三角形番号) の組をキーの順に並べたもの
+        self.cell_keys, self.cell_tris = self._rasterize(bvh, bounds)
+        self.keys = np.unique(self.cell_keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # 三角形のバウンディングボックスに含まれるセルのうち、三角形の平面が通るセルを求める
+    def _rasterize(self, bvh, bounds):
+        tri_ids, corners, lo, hi = triangle_cell_ranges(bvh, self.voxel_size, bounds)
+        if not len(tri_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        extent = hi - lo + 1
+        counts = extent.prod(axis=1)
+        tris = np.repeat(np.arange(len(corners)), counts)
+        local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        size_y = extent[tris, 1]
+        size_z = extent[tris, 2]
+        cells = lo[tris] + np.stack([local // (size_y * size_z), (local // size_z) % size_y, local % size_z], axis=1)
+        # セルの中心と三角形の平面の距離がセルの投影半径以下のものを残す
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        centers = (cells + 0.5) * self.voxel_size
+        distance = np.abs(np.einsum('ij,ij->i', centers - corners[tris, 0], normals[tris]))
+        reach = 0.5 * self.voxel_size * np.abs(normals[tris]).sum(axis=1)
+        keep = distance <= reach
+        keys = cell_keys(cells[keep])
+        tris = tri_ids[tris[keep]]
+        order = np.argsort(keys, kind='stable')
+        return keys[order], tris[order]
+
+    # 指定したキーのセルに含まれる (キー, 三角形番号) の範囲
+    def cell_ranges(self, keys):
+        starts = np.searchsorted(self.cell_keys, keys, side='left')
+        ends = np.searchsorted(self.cell_keys, keys, side='right')
+        return starts, ends - starts
+
+
+# 同じボクセルに表面がある三角形の組だけを交差判定し、交差しているフェース番号を返す
+def refine_shared_voxels(bvh_a, bvh_b, voxels_a, voxels_b):
+    shared = np.intersect1d(voxels_a.keys, voxels_b.keys, assume_unique=True)
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(shared):
+        return empty, empty
+    entries_a, entries_b = range_products(*(voxels_a.cell_ranges(shared) + voxels_b.cell_ranges(shared)))
+    # 複数のセルにまたがる三角形の組は一度だけ判定する
+    pair_ids = np.unique(voxels_a.cell_tris[entries_a] * bvh_b.num_triangles + voxels_b.cell_tris[entries_b])
+    tris_a = pair_ids // bvh_b.num_triangles
+    tris_b = pair_ids % bvh_b.num_triangles
+    found_a, found_b = [empty], [empty]
+    for begin in range(0, len(pair_ids), PAIR_CHUNK_SIZE):
+        chunk_a = tris_a[begin:begin + PAIR_CHUNK_SIZE]
+        chunk_b = tris_b[begin:begin + PAIR_CHUNK_SIZE]
+        hit = triangle_pairs_intersect(bvh_a.triangle_corners(chunk_a), bvh_b.triangle_corners(chunk_b))
+        found_a.append(chunk_a[hit])
+        found_b.append(chunk_b[hit])
+    return (np.unique(bvh_a.tri_faces[np.concatenate(found_a)]),
+            np.unique(bvh_b.tri_faces[np.concatenate(found_b)]))
+
+
+# セルの中心がメッシュの内部にあるかを判定
+# XY が同じセルの列ごとに +Z 方向へ1本だけレイを飛ばし、中心より手前の交差回数の偶奇で判定する
+def solid_cells(bvh, cells, voxel_size):
+    if not len(cells):
+        return np.zeros(0, dtype=bool)
+    columns, column_index = np.unique(cells[:, :2], axis=0, return_inverse=True)
+    column_index = column_index.ravel()
+    start_z = bvh.bounds[0][2] - voxel_size
+    origins = np.column_stack([(columns + 0.5) * voxel_size, np.full(len(columns), start_z)])
+    directions = np.tile([0.0, 0.0, 1.0], (len(columns), 1))
+    rays, params = bvh.all_hits(origins, directions)
+    # 列番号とZ座標を1つの値にまとめて、セルより手前の交差を二分探索で数える
+    span = bvh.bounds[1][2] - start_z + 2 * voxel_size
+    hit_keys = np.sort(rays * span + params)
+    cell_keys = column_index * span + ((cells[:, 2] + 0.5) * voxel_size - start_z)
+    column_keys = column_index * span
+    crossings = np.searchsorted(hit_keys, cell_keys) - np.searchsorted(hit_keys, column_keys)
+    return crossings % 2 != 0
+
+
+# 両方のメッシュの内部にあるボクセルを数えて、めり込んでいる体積の近似値を返す
+def overlap_volume(bvh_a, bvh_b, voxel_size):
+    bounds = intersect_bounds(bvh_a.bounds, bvh_b.bounds)
+    if bounds is None:
+        return 0.0
+    cells = cells_in_bounds(bounds[0], bounds[1], voxel_size)
+    # メッシュ1の内部にあるセルだけをメッシュ2で判定する
+    cells = cells[solid_cells(bvh_a, cells, voxel_size)]
+    cells = cells[solid_cells(bvh_b, cells, voxel_size)]
+    return float(len(cells)) * voxel_size ** 3
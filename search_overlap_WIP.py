@@ -11,8 +11,23 @@ from maya import OpenMayaUI as om
 from shiboken2 import wrapInstance
 import maya.cmds as cmds
 from maya.api import OpenMaya as om2
+import itertools
 import math
-import random
+import numpy as np
+from overlap_cache import MayaDirtyTracker, MeshCache, mesh_signature
+from overlap_engine import (
+    CONTAINMENT_METHODS, DEFAULT_CLEARANCE, FRAME_RANGE_MODE, OverlapEngine, SEARCH_MODES, SearchCancelled,
+    SearchMonitor)
+from overlap_geometry import FrameQueue, MeshArrays, sample_frame_points
+from overlap_highlight import component_names
+from overlap_instance import InstancedBVH, InstancedMesh, local_frame, matrix_from_mmatrix
+from overlap_profile import SearchProfile
+
+# 詳細ログの出力先 (Mayaのユーザー一時ディレクトリ)
+TRACE_FILE_NAME = "search_overlap_trace.log"
+# Frame Range で一度に取得するフレーム数と、判定スレッドに渡して未処理のまま置いておけるフレーム数
+FRAME_CHUNK_SIZE = 8
+FRAME_QUEUE_LIMIT = 32
 
 # ClickableFrame クラスを定義
 class ClickableFrame(QFrame):
@@ -43,6 +58,190 @@ class ClickableFrame(QFrame):
         else:
             print("Error: 'text_edit' is None.")
 
+# 結果ビューに表示するメッシュの組 (メッシュ番号2が None の場合は1つのメッシュだけの結果)
+class ResultGroup(object):
+
+    def __init__(self, row, i, j, faces1, faces2):
+        self.row = row
+        self.i = i
+        self.j = j
+        self.faces1 = np.asarray(faces1, dtype=np.int64)
+        self.faces2 = np.asarray(faces2, dtype=np.int64)
+
+    @property
+    def num_faces(self):
+        return len(self.faces1) + len(self.faces2)
+
+    # グループ内の行番号から (メッシュ番号, フェース番号) を求める
+    def face_at(self, row):
+        if row < len(self.faces1):
+            return self.i, int(self.faces1[row])
+        return self.j, int(self.faces2[row - len(self.faces1)])
+
+
+# 判定結果をメッシュの組ごとにまとめて表示するモデル
+# フェースはインデックス配列のまま保持し、行の文字列は表示されるときにだけ作成する
+class OverlapResultModel(QAbstractItemModel):
+
+    def __init__(self, parent=None):
+        super(OverlapResultModel, self).__init__(parent)
+        # メッシュ番号 -> シェイプのフルパス, 頂点配列
+        self.node_names = []
+        self.meshes = []
+        self.groups = []
+        # トップレベルの行の internalPointer
+        self._root = object()
+
+    # 判定対象のメッシュを設定し、結果をクリア
+    def set_meshes(self, node_names, meshes):
+        self.beginResetModel()
+        self.node_names = list(node_names)
+        self.meshes = list(meshes)
+        self.groups = []
+        self.endResetModel()
+
+    # メッシュの組の結果を1行追加
+    def add_group(self, i, j, faces1=(), faces2=()):
+        if not len(faces1) and not len(faces2):
+            return
+        row = len(self.groups)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.groups.append(ResultGroup(row, i, j, faces1, faces2))
+        self.endInsertRows()
+
+    # 判定結果から全ての行を作り直す
+    def set_result(self, result):
+        self.beginResetModel()
+        self.groups = []
+        for (i, j), (faces1, faces2) in sorted(result.pair_faces.items()):
+            if len(faces1) or len(faces2):
+                self.groups.append(ResultGroup(len(self.groups), i, j, faces1, faces2))
+        # ペア単位でフェースが分からない判定方法 (Sample) はメッシュごとにまとめる
+        grouped = set(group.i for group in self.groups) | set(group.j for group in self.groups)
+        for index, faces in sorted(result.mesh_faces.items()):
+            if index not in grouped:
+                self.groups.append(ResultGroup(len(self.groups), index, None, faces, ()))
+        self.endResetModel()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, self._root)
+        return self.createIndex(row, column, self.groups[parent.row()])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        group = index.internalPointer()
+        if group is self._root:
+            return QModelIndex()
+        return self.createIndex(group.row, 0, self._root)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self.groups)
+        if parent.internalPointer() is self._root:
+            return self.groups[parent.row()].num_faces
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    # インスタンスはシェイプ名が同じなので、トランスフォームの名前で表示する
+    def short_name(self, index):
+        names = self.node_names[index].rsplit("|", 2)
+        return names[-2] if len(names) > 2 and names[-2] else names[-1]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        group = index.internalPointer()
+        if group is self._root:
+            group = self.groups[index.row()]
+            if group.j is None:
+                return f"{self.short_name(group.i)} ({len(group.faces1)} faces)"
+            if group.i == group.j:
+                return f"{self.short_name(group.i)} (self, {len(group.faces1)} faces)"
+            return (f"{self.short_name(group.i)} / {self.short_name(group.j)} "
+                    f"({len(group.faces1)} / {len(group.faces2)} faces)")
+        mesh_index, face_index = group.face_at(index.row())
+        vertex_indices = self.meshes[mesh_index].face_vertices(face_index).tolist()
+        return f"{self.short_name(mesh_index)}: Face Index {face_index}, Vertex Indices: {vertex_indices}"
+
+    # 行に対応するMayaのコンポーネント名 (グループの行は全てのフェース)
+    def components(self, index):
+        if not index.isValid():
+            return []
+        group = index.internalPointer()
+        if group is self._root:
+            group = self.groups[index.row()]
+            components = component_names(self.node_names[group.i], group.faces1)
+            if group.j is not None:
+                components.extend(component_names(self.node_names[group.j], group.faces2))
+            return components
+        mesh_index, face_index = group.face_at(index.row())
+        return component_names(self.node_names[mesh_index], [face_index])
+
+# 衝突判定をバックグラウンドで実行するスレッド
+# Maya APIは使わず、BVHの作成と判定だけを行う
+class SearchWorker(QThread):
+    # 完了数, 全体数, メッシュ番号1, メッシュ番号2, フェース1, フェース2
+    pair_done = Signal(int, int, int, int, object, object)
+    # 完了数, 全体数 (フレーム範囲の判定で使う)
+    progress = Signal(int, int)
+    # Progressive の粗い判定で重なったメッシュの組のリスト
+    coarse_finished = Signal(object)
+    # 判定結果, BVHのリスト
+    search_finished = Signal(object, object)
+    search_cancelled = Signal()
+    search_failed = Signal(str)
+
+    def __init__(self, engine, mode, options, keys, meshes, bvhs, changed_keys, profile, parent=None):
+        super(SearchWorker, self).__init__(parent)
+        self.engine = engine
+        self.mode = mode
+        # 判定方法ごとの設定 (containment, voxel_size, clearance, フレーム範囲の場合は frame_points)
+        self.options = options
+        self.keys = keys
+        self.meshes = meshes
+        self.bvhs = bvhs
+        self.changed_keys = changed_keys
+        self.profile = profile
+        self.monitor = SearchMonitor(on_pair_done=self.emit_pair_done, on_progress=self.progress.emit,
+                                     on_coarse_done=self.coarse_finished.emit)
+
+    def emit_pair_done(self, done, total, i, j, faces1, faces2):
+        self.pair_done.emit(done, total, int(i), int(j), faces1, faces2)
+
+    def cancel(self):
+        self.monitor.cancel()
+
+    def run(self):
+        try:
+            if self.mode == FRAME_RANGE_MODE:
+                # フレーム範囲用のBVHは判定の中で作成するので、キャッシュのBVHはそのまま返す
+                result = self.engine.scan_frames(self.meshes, self.options["frame_points"], self.monitor, self.profile)
+                self.search_finished.emit(result, self.bvhs)
+                return
+            if self.mode == "Progressive":
+                # 元の解像度のBVHは粗い判定で重なったメッシュだけ判定の中で作成する
+                result, bvhs = self.engine.progressive_search(self.meshes, self.bvhs, self.monitor, self.profile)
+                self.search_finished.emit(result, bvhs)
+                return
+            bvhs = self.engine.build_missing_bvhs(self.meshes, self.bvhs, self.monitor, self.profile)
+            if self.mode == "Exact":
+                # 前回から変更されたメッシュを含むペアだけを再判定する
+                result = self.engine.search_incremental(
+                    self.keys, self.meshes, bvhs, self.changed_keys, self.monitor, self.profile)
+            else:
+                result = self.engine.search(self.meshes, bvhs, self.mode, self.monitor, self.profile, **self.options)
+            self.search_finished.emit(result, bvhs)
+        except SearchCancelled:
+            self.search_cancelled.emit()
+        except Exception as e:
+            self.search_failed.emit(str(e))
+
 # メインのクラス
 class MainWindow(QtWidgets.QWidget):
     def __init__(self, parent=None):
@@ -51,10 +250,35 @@ class MainWindow(QtWidgets.QWidget):
         self.set_UI()
         #実行時に赤いマテリアルを作成
         self.create_red_material()
-        #ハイライトされた情報を保存
-        self.highlight_states = {}
         # 元のマテリアルを保存
         self.materials = {}
+        # 衝突判定の処理本体
+        self.engine = OverlapEngine()
+        # メッシュの頂点配列とBVHのキャッシュ (シェイプごとにオブジェクト空間で保持)
+        self.mesh_cache = MeshCache()
+        # インスタンスのDAGパス -> シェイプのキー、シェイプのキー -> インスタンスのDAGパス
+        self.instance_shapes = {}
+        self.shape_instances = {}
+        self.dirty_tracker = MayaDirtyTracker(self.mesh_cache)
+        self.dirty_tracker.listeners.append(self.on_mesh_dirty)
+        # 前回の判定から変更されたメッシュ
+        self.changed_keys = set()
+        # 前回ハイライトしたメッシュのフェース (キー -> フェース番号)
+        self.highlighted_meshes = {}
+        # Live が有効なときはメッシュの変更後に少し待ってから再判定する
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.setSingleShot(True)
+        self.live_timer.setInterval(500)
+        self.live_timer.timeout.connect(self.search_button_onClicked)
+        # 実行中の判定スレッドと、その判定対象 (dag_paths, keys, meshes)
+        self.search_worker = None
+        self.search_context = None
+        # Frame Range では判定と並行してメインスレッドでフレームを少しずつ取得する
+        self.frame_sampler = None
+        self.frame_queue = None
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setInterval(10)
+        self.frame_timer.timeout.connect(self.feed_frames)
 
     # UI構成
     def set_UI(self):
@@ -72,6 +296,41 @@ class MainWindow(QtWidgets.QWidget):
         self.search_button = QtWidgets.QPushButton("Search")
         self.refreshButton = QtWidgets.QPushButton("Refresh")
         self.select_enable_CheckBox = QtWidgets.QCheckBox("Enable Select ", self)
+        # 判定方法 (Sample: サンプルポイントのレイキャスト, Exact: 三角形同士の交差判定)
+        self.search_mode_comboBox = QtWidgets.QComboBox(self)
+        self.search_mode_comboBox.addItems(list(SEARCH_MODES) + [FRAME_RANGE_MODE])
+        # Sample の内部判定の方法 (Ray Parity: レイの交差回数の偶奇, Winding Number: 一般化巻き数)
+        self.containment_comboBox = QtWidgets.QComboBox(self)
+        self.containment_comboBox.addItems(list(CONTAINMENT_METHODS))
+        # Voxel のボクセルの一辺 (0 の場合はメッシュの大きさから自動で決める)
+        self.voxel_size_spinBox = QtWidgets.QDoubleSpinBox(self)
+        self.voxel_size_spinBox.setDecimals(4)
+        self.voxel_size_spinBox.setRange(0.0, 1000.0)
+        self.voxel_size_spinBox.setSingleStep(0.01)
+        self.voxel_size_spinBox.setSpecialValueText("Auto")
+        self.voxel_size_spinBox.setEnabled(False)
+        # Clearance で近すぎるとみなす距離
+        self.clearance_spinBox = QtWidgets.QDoubleSpinBox(self)
+        self.clearance_spinBox.setDecimals(4)
+        self.clearance_spinBox.setRange(0.0, 1000.0)
+        self.clearance_spinBox.setSingleStep(0.01)
+        self.clearance_spinBox.setValue(DEFAULT_CLEARANCE)
+        self.clearance_spinBox.setEnabled(False)
+        # Frame Range で判定するフレーム範囲 (初期値は再生範囲)
+        self.start_frame_spinBox = QtWidgets.QSpinBox(self)
+        self.end_frame_spinBox = QtWidgets.QSpinBox(self)
+        for spin_box, flag in ((self.start_frame_spinBox, "minTime"), (self.end_frame_spinBox, "maxTime")):
+            spin_box.setRange(-100000, 100000)
+            spin_box.setValue(int(cmds.playbackOptions(query=True, **{flag: True})))
+            spin_box.setEnabled(False)
+        # メッシュを動かしたときに自動で再判定する
+        self.live_CheckBox = QtWidgets.QCheckBox("Live", self)
+        # 判定の詳細ログをファイルに書き出す
+        self.trace_CheckBox = QtWidgets.QCheckBox("Trace", self)
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setVisible(False)
         self.infoeditor = ClickableFrame(self)
         self.infoeditor.setFrameStyle(QFrame.Panel | QFrame.Raised)
         self.infoeditor.setLayout(QVBoxLayout())
@@ -81,6 +340,13 @@ class MainWindow(QtWidgets.QWidget):
         self.text_editor.setReadOnly(True)
         self.text_editor.setVisible(False)
         self.infoeditor.set_text_edit(self.text_editor)
+        # メッシュの組ごとの結果 (表示される行だけを作成し、クリックでフェースを選択する)
+        self.result_model = OverlapResultModel(self)
+        self.result_view = QTreeView(self)
+        self.result_view.setModel(self.result_model)
+        self.result_view.setHeaderHidden(True)
+        self.result_view.setUniformRowHeights(True)
+        self.result_view.setVisible(False)
 
     # レイアウトの作成
     def create_layout(self):
@@ -100,12 +366,23 @@ class MainWindow(QtWidgets.QWidget):
         self.bottom_layout.addWidget(self.addButton)
         self.bottom_layout.addWidget(self.removeButton)
         self.bottom_layout.addWidget(self.search_button)
+        self.bottom_layout.addWidget(self.cancel_button)
         self.bottom_layout.addWidget(self.refreshButton)
         self.bottom_layout.addWidget(self.select_enable_CheckBox)
+        self.bottom_layout.addWidget(self.search_mode_comboBox)
+        self.bottom_layout.addWidget(self.containment_comboBox)
+        self.bottom_layout.addWidget(self.voxel_size_spinBox)
+        self.bottom_layout.addWidget(self.clearance_spinBox)
+        self.bottom_layout.addWidget(self.start_frame_spinBox)
+        self.bottom_layout.addWidget(self.end_frame_spinBox)
+        self.bottom_layout.addWidget(self.live_CheckBox)
+        self.bottom_layout.addWidget(self.trace_CheckBox)
 
         scroll_area.setWidget(self.centralWidget)
         self.whole_layout.addWidget(self.infoeditor)
+        self.whole_layout.addWidget(self.result_view)
         self.whole_layout.addWidget(self.text_editor)
+        self.whole_layout.addWidget(self.progress_bar)
 
         self.whole_layout.addLayout(self.bottom_layout)
         self.setLayout(self.whole_layout)
@@ -117,7 +394,10 @@ class MainWindow(QtWidgets.QWidget):
         self.refreshButton.clicked.connect(self.refreshButton_onClicked)
         self.select_enable_CheckBox.stateChanged.connect(self.select_enable)
         self.search_button.clicked.connect(self.search_button_onClicked)
+        self.search_mode_comboBox.currentTextChanged.connect(self.search_mode_changed)
+        self.cancel_button.clicked.connect(self.cancel_button_onClicked)
         self.infoeditor.clicked.connect(self.toggle_text_editor)
+        self.result_view.clicked.connect(self.result_view_clicked)
         self.list.itemSelectionChanged.connect(self.list_selection_changed)
 
     # addButtonの関数
@@ -133,8 +413,6 @@ class MainWindow(QtWidgets.QWidget):
             for item in items:
                 short_name = cmds.ls(item, shortNames=True)[0]
                 self.list.addItem(short_name)
-                # ハイライト状態を初期化
-                self.highlight_states[short_name] = False
         else:
             print("No objects in list selected")
 
@@ -157,26 +435,260 @@ class MainWindow(QtWidgets.QWidget):
         # クリアした後に選択状態を復元する
         self.add_items_to_list(selected_items)
         # 元のマテリアルに戻す
-        for item_name in selected_items:
-            self.restore_material(item_name)
+        self.restore_materials(selected_items)
 
     # 衝突判定
     def search_button_onClicked(self):
+        # 判定中は新しい判定を開始しない
+        if self.search_worker is not None:
+            return
         try:
             selected_items = [item.text() for item in self.list.selectedItems()]
-            if len(selected_items) > 1:
-                dag_paths = []
+            # 自己交差の判定は1つのメッシュから行える
+            min_items = 1 if self.search_mode_comboBox.currentText() == "Self" else 2
+            if len(selected_items) >= min_items:
+                profile = SearchProfile(self.get_trace_path() if self.trace_CheckBox.isChecked() else None)
+                dag_paths, item_names = [], []
                 for item_name in selected_items:
                     dag_path, item_mesh_fn = self.get_dag_path_from_item(item_name)
                     if dag_path is not None and item_mesh_fn is not None:
                         dag_paths.append((dag_path, item_mesh_fn))
-                sample_points = self.generate_sample_points(dag_paths)
-                for dag_path, item_mesh_fn in dag_paths:
-                    item_mesh_fn = om2.MFnMesh(dag_path)
-                    self.sample_point_ray_cast(item_mesh_fn, sample_points, dag_path)
+                        item_names.append(item_name)
+                # 頂点とフェース構成はメッシュごとに一度だけ取得し、変更がなければキャッシュを使う
+                meshes, bvhs = [], []
+                with profile.stage("extraction"):
+                    for dag_path, item_mesh_fn in dag_paths:
+                        mesh, bvh = self.get_mesh_data(dag_path, item_mesh_fn)
+                        meshes.append(mesh)
+                        bvhs.append(bvh)
+                keys = [dag_path.fullPathName() for dag_path, _ in dag_paths]
+                frame_points = None
+                if self.search_mode_comboBox.currentText() == FRAME_RANGE_MODE:
+                    # Maya APIは判定スレッドから使えないので、頂点座標はメインスレッドで数フレームずつ取得して渡す
+                    frames = range(self.start_frame_spinBox.value(), self.end_frame_spinBox.value() + 1)
+                    item_mesh_fns = [item_mesh_fn for _, item_mesh_fn in dag_paths]
+                    self.frame_sampler = sample_frame_points(item_mesh_fns, frames)
+                    self.frame_queue = frame_points = FrameQueue(len(frames))
+                self.start_search(dag_paths, keys, meshes, bvhs, profile, frame_points, item_names)
+                if self.frame_queue is not None:
+                    self.frame_timer.start()
         except Exception as e:
+            self.stop_frame_sampling(e)
             print(f"An error occurred in search_button_onClicked: {str(e)}")
 
+    # 内部判定の方法は Sample、ボクセルの大きさは Voxel、距離は Clearance、
+    # フレーム範囲は Frame Range のときだけ変更できるようにする
+    def search_mode_changed(self, mode):
+        self.containment_comboBox.setEnabled(mode == "Sample")
+        self.voxel_size_spinBox.setEnabled(mode == "Voxel")
+        self.clearance_spinBox.setEnabled(mode == "Clearance")
+        self.start_frame_spinBox.setEnabled(mode == FRAME_RANGE_MODE)
+        self.end_frame_spinBox.setEnabled(mode == FRAME_RANGE_MODE)
+
+    # cancel_buttonの関数
+    def cancel_button_onClicked(self):
+        if self.search_worker is not None:
+            self.search_worker.cancel()
+            # フレームを待っている判定スレッドも止める
+            self.stop_frame_sampling(SearchCancelled())
+
+    # 判定スレッドが処理しきれていないフレームが少なければ、次の数フレームを取得して渡す
+    def feed_frames(self):
+        if self.frame_queue is None or self.frame_queue.pending() >= FRAME_QUEUE_LIMIT:
+            return
+        try:
+            with self.search_worker.profile.stage("extraction"):
+                chunk = list(itertools.islice(self.frame_sampler, FRAME_CHUNK_SIZE))
+        except Exception as e:
+            self.stop_frame_sampling(e)
+            return
+        for frame, points_list in chunk:
+            self.frame_queue.put(frame, points_list)
+        if len(chunk) < FRAME_CHUNK_SIZE:
+            self.stop_frame_sampling()
+
+    # フレームの取得を終了して元のフレームに戻し、判定スレッドに終了 (または例外) を伝える
+    def stop_frame_sampling(self, error=None):
+        self.frame_timer.stop()
+        if self.frame_sampler is not None:
+            self.frame_sampler.close()
+            self.frame_sampler = None
+        if self.frame_queue is not None:
+            self.frame_queue.close(error)
+            self.frame_queue = None
+
+    # 判定スレッドを開始
+    def start_search(self, dag_paths, keys, meshes, bvhs, profile, frame_points=None, item_names=None):
+        mode = self.search_mode_comboBox.currentText()
+        options = {
+            "containment": self.containment_comboBox.currentText(),
+            "voxel_size": self.voxel_size_spinBox.value() or None,
+            "clearance": self.clearance_spinBox.value(),
+        }
+        if mode == FRAME_RANGE_MODE:
+            options = {"frame_points": frame_points}
+        self.search_context = (dag_paths, keys, meshes, item_names or [])
+        # 変更されたメッシュを含む前回のペアの結果は判定方法によらずここで破棄する
+        # (Exact 以外の判定や、中断・失敗した判定の後でも変更が失われないようにする)
+        self.engine.invalidate_pairs(self.changed_keys)
+        self.search_worker = SearchWorker(
+            self.engine, mode, options, keys, meshes, bvhs, set(self.changed_keys), profile, self)
+        self.changed_keys.clear()
+        self.search_worker.pair_done.connect(self.on_pair_done)
+        self.search_worker.progress.connect(self.on_progress)
+        self.search_worker.coarse_finished.connect(self.on_coarse_finished)
+        self.search_worker.search_finished.connect(self.on_search_finished)
+        self.search_worker.search_cancelled.connect(self.on_search_cancelled)
+        self.search_worker.search_failed.connect(self.on_search_failed)
+        self.search_worker.finished.connect(self.on_worker_finished)
+        self.text_editor.clear()
+        self.result_model.set_meshes(keys, meshes)
+        # 前回の粗い判定で付けたリストの色を戻す
+        for row in range(self.list.count()):
+            self.list.item(row).setForeground(QBrush())
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setEnabled(True)
+        self.search_button.setEnabled(False)
+        if profile.tracing:
+            self.text_editor.appendPlainText(f"Trace: {profile.trace_path}")
+        self.search_worker.start()
+
+    # ペアの判定が終わるごとに進捗と結果を表示
+    def on_pair_done(self, done, total, i, j, faces1, faces2):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.result_model.add_group(i, j, faces1, faces2)
+
+    def on_progress(self, done, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    # Progressive の粗い判定が終わったら、重なっているオブジェクトをフェースの判定より先にリストで示す
+    def on_coarse_finished(self, pairs):
+        dag_paths, keys, meshes, item_names = self.search_context
+        overlap_names = set(item_names[index] for pair in pairs for index in pair if index < len(item_names))
+        for row in range(self.list.count()):
+            item = self.list.item(row)
+            if item.text() in overlap_names:
+                item.setForeground(QBrush(QColor(255, 80, 80)))
+        for i, j in pairs:
+            self.text_editor.appendPlainText(f"Overlapping objects: {self.result_model.short_name(i)} / {self.result_model.short_name(j)}")
+        self.text_editor.appendPlainText(f"Coarse pairs: {len(pairs)}, refining faces...")
+
+    # 判定が終わったら結果をハイライト
+    def on_search_finished(self, result, bvhs):
+        dag_paths, keys, meshes, _ = self.search_context
+        # スレッドで作成したオブジェクト空間のBVHをキャッシュに追加
+        if result.mode != FRAME_RANGE_MODE:
+            for key, mesh, bvh in zip(keys, meshes, bvhs):
+                self.mesh_cache.set_bvh(self.instance_shapes.get(key), mesh.mesh, local_frame(bvh)[0])
+        with result.profile.stage("highlighting"):
+            self.apply_search_result(dag_paths, keys, result)
+        self.result_model.set_result(result)
+        # Voxel で求めたペアごとのめり込んでいる体積を表示
+        for (i, j), volume in sorted(result.pair_volumes.items()):
+            self.text_editor.appendPlainText(
+                f"{self.result_model.short_name(i)} / {self.result_model.short_name(j)}: volume {volume:.6g}")
+        # Clearance で求めたペアごとの最短距離を表示
+        for (i, j), (distances1, distances2) in sorted(result.pair_distances.items()):
+            min_distance = min(list(distances1) + list(distances2))
+            self.text_editor.appendPlainText(
+                f"{self.result_model.short_name(i)} / {self.result_model.short_name(j)}: min distance {min_distance:.6g}")
+        # フレーム範囲の判定はフレームごとに重なったペアを表示
+        if result.mode == FRAME_RANGE_MODE:
+            for frame in result.overlap_frames:
+                for (i, j), (faces1, faces2) in sorted(result.frame_pairs[frame].items()):
+                    self.text_editor.appendPlainText(
+                        f"Frame {frame}: {self.result_model.short_name(i)} / {self.result_model.short_name(j)} "
+                        f"({len(faces1)} / {len(faces2)} faces)")
+            self.text_editor.appendPlainText(
+                f"Overlapping frames: {len(result.overlap_frames)} / {len(result.frames)}")
+        # 段階ごとの処理時間とカウンタを表示
+        self.text_editor.appendPlainText("--- Search profile ---")
+        for line in result.profile.summary_lines():
+            self.text_editor.appendPlainText(line)
+
+    def on_search_cancelled(self):
+        self.text_editor.appendPlainText("Search cancelled.")
+
+    def on_search_failed(self, message):
+        print(f"An error occurred in search: {message}")
+
+    # 判定スレッドの後始末
+    def on_worker_finished(self):
+        self.stop_frame_sampling()
+        frame_range = self.search_worker.mode == FRAME_RANGE_MODE
+        self.search_worker.profile.close()
+        self.search_worker.deleteLater()
+        self.search_worker = None
+        self.search_context = None
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setEnabled(False)
+        self.search_button.setEnabled(True)
+        # 判定中に変更されたメッシュがあれば再判定する
+        # Frame Range ではフレームの切り替えでアニメーションするメッシュが必ず変更されるので、次の判定まで記録だけ残す
+        if self.changed_keys and self.live_CheckBox.isChecked() and not frame_range:
+            self.live_timer.start()
+
+    # キャッシュからメッシュの頂点配列とBVHを取得し、インスタンスのワールド行列で配置する (なければ作成)
+    # 頂点配列とBVHはシェイプごとにオブジェクト空間で保持し、インスタンスや複製されたメッシュで共有する
+    def get_mesh_data(self, dag_path, item_mesh_fn):
+        key = dag_path.fullPathName()
+        # インスタンスは同じシェイプを共有するので、シェイプの最初のDAGパスをキャッシュのキーにする
+        shape_key = om2.MDagPath.getAPathTo(dag_path.node()).fullPathName()
+        self.instance_shapes[key] = shape_key
+        self.shape_instances.setdefault(shape_key, set()).add(key)
+        if self.dirty_tracker.is_watching(shape_key):
+            entry = self.mesh_cache.get(shape_key)
+            mesh = None
+        else:
+            # コールバックで監視できないメッシュは頂点とフェース構成のハッシュで変更を確認
+            mesh = MeshArrays.from_mesh_fn(item_mesh_fn, om2.MSpace.kObject)
+            entry = self.mesh_cache.get(shape_key, mesh_signature(mesh))
+        if entry is None:
+            if mesh is None:
+                mesh = MeshArrays.from_mesh_fn(item_mesh_fn, om2.MSpace.kObject)
+            signature = mesh_signature(mesh)
+            # 頂点座標とフェース構成が同じ別のシェイプがあれば、その頂点配列とBVHを共有する
+            bvh = None
+            shared = self.mesh_cache.find_signature(signature)
+            if shared is not None:
+                mesh, bvh = shared.mesh, shared.bvh
+            self.dirty_tracker.watch(shape_key, dag_path)
+            # BVHは判定スレッドで作成する
+            entry = self.mesh_cache.put(shape_key, mesh, bvh, signature)
+            self.changed_keys.update(self.shape_instances[shape_key])
+        self.dirty_tracker.watch_transform(key, dag_path)
+        matrix = matrix_from_mmatrix(dag_path.inclusiveMatrix())
+        bvh = InstancedBVH(entry.bvh, matrix) if entry.bvh is not None else None
+        return InstancedMesh(entry.mesh, matrix, key), bvh
+
+    # 詳細ログのファイルパス
+    def get_trace_path(self):
+        return os.path.join(cmds.internalVar(userTmpDir=True), TRACE_FILE_NAME)
+
+    # メッシュが変更されたときの処理 (シェイプの変更はそのインスタンス全てを変更とみなす)
+    def on_mesh_dirty(self, key):
+        self.changed_keys.add(key)
+        self.changed_keys.update(self.shape_instances.get(key, ()))
+        # Frame Range でフレームを切り替えている間の変更では Live の再判定を始めない
+        # (その間にユーザーが動かしたメッシュもあるので、変更の記録はしておく)
+        if self.frame_sampler is not None:
+            return
+        if self.live_CheckBox.isChecked():
+            self.live_timer.start()
+
+    # ウィンドウを閉じるときにコールバックを解除
+    def closeEvent(self, event):
+        if self.search_worker is not None:
+            self.search_worker.cancel()
+            self.stop_frame_sampling(SearchCancelled())
+            self.search_worker.wait()
+        self.dirty_tracker.remove_all()
+        self.mesh_cache.clear()
+        super(MainWindow, self).closeEvent(event)
+
     # 赤いマテリアルを作成
     def create_red_material(self):
         red_material_name = "redMaterial"
@@ -187,6 +699,14 @@ class MainWindow(QtWidgets.QWidget):
             # マテリアルをシェーディング グループに関連付け
             cmds.surfaceShaderList(red_material_name, add=shading_group_name)
         self.red_material_name = red_material_name
+        self.red_shading_group = self.get_shading_group(red_material_name)
+
+    # マテリアルに接続されているシェーディンググループを取得
+    def get_shading_group(self, material):
+        shading_groups = cmds.listConnections(material, type='shadingEngine')
+        if shading_groups:
+            return shading_groups[0]
+        return None
 
     # マテリアルを保存
     def save_material(self, item_name):
@@ -197,19 +717,29 @@ class MainWindow(QtWidgets.QWidget):
             if material:
                 self.materials[item_name] = material[0]
 
-    # マテリアルを復元
-    def restore_material(self, item_name):
-        if item_name in self.materials:
-            material = self.materials[item_name]
-            cmds.select(item_name, replace=True)
-            cmds.hyperShade(assign=material)
+    # 複数のオブジェクトのマテリアルをシェーディンググループごとにまとめて復元
+    def restore_materials(self, item_names):
+        members = {}
+        for item_name in item_names:
+            if item_name in self.materials:
+                shading_group = self.get_shading_group(self.materials[item_name])
+                if shading_group:
+                    members.setdefault(shading_group, []).append(item_name)
+        if not members:
+            return
+        # マテリアルの割り当てでは形状は変わらないので、キャッシュの破棄と再判定をしない
+        cmds.undoInfo(openChunk=True, chunkName="restoreOverlapMaterial")
+        try:
+            with self.dirty_tracker.muted():
+                for shading_group, names in members.items():
+                    cmds.sets(names, edit=True, forceElement=shading_group)
+        finally:
+            cmds.undoInfo(closeChunk=True)
 
     # 選択されたアイテムをリストから削除
     def remove_selected_items(self, selected_items):
         if selected_items:
             for item in selected_items:
-                if item.text() in self.highlight_states:
-                    del self.highlight_states[item.text()]
                 self.list.takeItem(self.list.row(item))
             print(f"{len(selected_items)} items removed from the list")
         else:
@@ -222,31 +752,12 @@ class MainWindow(QtWidgets.QWidget):
         for item in items:
             cmds.select(item.text(), add=True)
 
-    # Info Editorを更新
-    def update_info_editor(self, highlighted_faces_info):
-        if self.text_editor:
-            # ハイライトされたフェースをリセット
-            for item_name in self.highlight_states:
-                if self.highlight_states[item_name]:
-                    self.restore_material(item_name)
-                    self.highlight_states[item_name] = False
-            if highlighted_faces_info:
-                for info in highlighted_faces_info:
-                    self.text_editor.appendPlainText(info)
-        else:
-            print("Error: 'text_editor' is None.")
-
-    # ハイライトされたフェースの情報を取得
-    def get_highlighted_faces_info(self, item_mesh_fn, face_indices):
-        highlighted_faces_info = []
-        for face_index in face_indices:
-            vertex_indices = item_mesh_fn.getPolygonVertices(face_index)
-            # MIntArrayをPythonのリストに変換
-            vertex_indices_list = [vertex_indices[i] for i in range(len(vertex_indices))]
-            # 文字列に変換
-            info_str = f"Face Index {face_index}, Vertex Indices: {vertex_indices_list}"
-            highlighted_faces_info.append(info_str)
-        return highlighted_faces_info
+    # 結果ビューの行をクリックしたら、そのフェースをMayaで選択する
+    def result_view_clicked(self, index):
+        components = self.result_model.components(index)
+        if components:
+            cmds.select(components, replace=True)
+            cmds.hilite(replace=True)
 
     # 選択したオブジェクトのDagPathを取得する
     def get_dag_path_from_item(self, item_name):
@@ -287,207 +798,55 @@ class MainWindow(QtWidgets.QWidget):
     def toggle_text_editor(self):
         current_visibility = self.text_editor.isVisible()
         self.text_editor.setVisible(not current_visibility)
-        if current_visibility:
-            selected_items = self.list.selectedItems()
-            self.update_info_editor(selected_items)
-
-    # 複数のオブジェクトのメッシュの内部にあるサンプルポイントを生成
-    def generate_sample_points(self, dag_paths):
-        sample_points = []
-        inside_point = []
-        for i in range(len(dag_paths)):
-            for j in range(i + 1, len(dag_paths)):
-                dag_path1, item_mesh_fn1 = dag_paths[i]
-                dag_path2, item_mesh_fn2 = dag_paths[j]
-                points1 = item_mesh_fn1.getPoints(om2.MSpace.kWorld)
-                points2 = item_mesh_fn2.getPoints(om2.MSpace.kWorld)
-                # 他方のメッシュの内部に存在する頂点の取得
-                self.point_inside_mesh(points1, points2, item_mesh_fn1, item_mesh_fn2, inside_point)
-                # バウンディングボックス内のポイントを抽出
-                self.point_inside_bouding_box(points1, points2, item_mesh_fn1, item_mesh_fn2, inside_point)
-
-        # 重複を避けてランダムな2つの頂点を選択して中点を生成
-        for i in range(len(inside_point) // 2):
-            point1, point2 = random.sample(inside_point, 2)
-            middle_point = om2.MVector((point1.x + point2.x) / 2, (point1.y + point2.y) / 2, (point1.z + point2.z) / 2)
-            sample_points.append(middle_point)
-        print(f"inside_point: {len(inside_point)}")
-        return sample_points
-
-    def point_inside_mesh(self, points1, points2, item_mesh_fn1, item_mesh_fn2, inside_point):
-        # メッシュ1の各面の中心座標を計算し、レイキャストを行い、メッシュ2の内部にある頂点を取得
-        for face_index in range(item_mesh_fn1.numPolygons):
-            face_vertices = item_mesh_fn1.getPolygonVertices(face_index)
-            face_center = om2.MPoint()
-            for vertex_index in face_vertices:
-                point = points1[vertex_index]
-                face_center.x += point.x
-                face_center.y += point.y
-                face_center.z += point.z
-            face_center.x /= len(face_vertices)
-            face_center.y /= len(face_vertices)
-            face_center.z /= len(face_vertices)
-
-            # メッシュの法線方向を取得
-            face_normal = item_mesh_fn1.getPolygonNormal(face_index, om2.MSpace.kWorld)
-
-            # 面の法線方向に沿ってレイの開始点を内側に調整
-            ray_origin = face_center + 0.001 * face_normal
-            ray_origin_float = om2.MFloatPoint(ray_origin.x, ray_origin.y, ray_origin.z)
-            ray_direction_float = om2.MFloatVector(-face_normal.x, -face_normal.y, -face_normal.z)
-
-            intersections = item_mesh_fn2.allIntersections(
-                ray_origin_float, ray_direction_float, om2.MSpace.kWorld, 99999, False
-            )
-            if intersections:
-                num_intersections = len(intersections[0])
-                # 交差回数が奇数の場合他方のメッシュ内部で衝突したとする
-                if num_intersections % 2 != 0:
-                    if face_center not in inside_point:
-                        inside_point.append(face_center)
-
-        # メッシュ2の各面の中心座標を計算し、レイキャストを行い、メッシュ1の内部にある頂点を取得
-        for face_index in range(item_mesh_fn2.numPolygons):
-            face_vertices = item_mesh_fn2.getPolygonVertices(face_index)
-            face_center = om2.MPoint(0, 0, 0)
-            for vertex_index in face_vertices:
-                point = points1[vertex_index]
-                face_center.x += point.x
-                face_center.y += point.y
-                face_center.z += point.z
-            face_center.x /= len(face_vertices)
-            face_center.y /= len(face_vertices)
-            face_center.z /= len(face_vertices)
-
-            # メッシュの法線方向を取得
-            face_normal = item_mesh_fn2.getPolygonNormal(face_index, om2.MSpace.kWorld)
-
-            # 面の法線方向に沿ってレイの開始点を内側に調整
-            ray_origin = face_center + 0.001 * face_normal
-            ray_origin_float = om2.MFloatPoint(ray_origin.x, ray_origin.y, ray_origin.z)
-            ray_direction_float = om2.MFloatVector(-face_normal.x, -face_normal.y, -face_normal.z)
-
-            intersections = item_mesh_fn1.allIntersections(
-                ray_origin_float, ray_direction_float, om2.MSpace.kWorld, 99999, False
-            )
-            if intersections:
-                num_intersections = len(intersections[0])
-                # 交差回数が奇数の場合他方のメッシュ内部で衝突したとする
-                if num_intersections % 2 != 0:
-                    if face_center not in inside_point:
-                        inside_point.append(face_center)
-
-        # メッシュ1とメッシュ2の両方の境界ボックス内にある点を残す
-        inside_point[:] = [
-            point for point in inside_point
-            if self.is_point_inside_bounding_box(point, item_mesh_fn1.boundingBox, item_mesh_fn2.boundingBox)
-        ]
-
+        self.result_view.setVisible(not current_visibility)
 
-    def point_inside_bouding_box(self, points1, points2, item_mesh_fn1, item_mesh_fn2, inside_point):
-        # メッシュ1の境界ボックスを取得
-        bbox1 = item_mesh_fn1.boundingBox
+    # 判定結果をハイライトに反映
+    def apply_search_result(self, dag_paths, keys, result):
+        current_faces = {keys[index]: faces for index, faces in result.mesh_faces.items()}
 
-        # メッシュ2の境界ボックスを取得
-        bbox2 = item_mesh_fn2.boundingBox
-
-        # メッシュ1とメッシュ2の両方の境界ボックス内にある点を残す
-        inside_point[:] = [
-            point for point in inside_point
-            if self.is_point_inside_bounding_box(point, bbox1, bbox2)
+        # 結果が変わったメッシュは元のマテリアルに戻してからハイライトし直す
+        stale_keys = [
+            key for key in keys
+            if key in self.highlighted_meshes
+            and not np.array_equal(self.highlighted_meshes[key], current_faces.get(key, ()))
         ]
-
-
-    def is_point_inside_bounding_box(self, point, bbox1, bbox2):
-        transformation_matrix = om2.MMatrix()
-        # 境界ボックスの最小と最大の各座標値をワールド座標系に変換
-        bbox1_min = bbox1.min * transformation_matrix
-        bbox1_max = bbox1.max * transformation_matrix
-        bbox2_min = bbox2.min * transformation_matrix
-        bbox2_max = bbox2.max * transformation_matrix
-
-        # ポイントが境界ボックス内にあるかどうかをチェック
-        return (
-            bbox1_min.x <= point.x <= bbox1_max.x
-            and bbox1_min.y <= point.y <= bbox1_max.y
-            and bbox1_min.z <= point.z <= bbox1_max.z
-            and bbox2_min.x <= point.x <= bbox2_max.x
-            and bbox2_min.y <= point.y <= bbox2_max.y
-            and bbox2_min.z <= point.z <= bbox2_max.z
-        )
-
-    # レイの方向を取得する関数
-    def get_ray_direction(self, direction_index):
-        # 定義された方向のベクトルを取得
-        directions = [
-            om2.MFloatVector(0, -1, 0),
-            om2.MFloatVector(0, 1, 0),
-            om2.MFloatVector(-1, 0, 0),
-            om2.MFloatVector(1, 0, 0),
-            om2.MFloatVector(0, 0, -1),
-            om2.MFloatVector(0, 0, 1)
-        ]
-        # 3D 方向ベクトルの正規化
-        if direction_index < len(directions):
-            directions[direction_index].normalize()
-        return directions[direction_index]
-
-    # 衝突判定を行う関数
-    def sample_point_ray_cast(self, item_mesh_fn, sample_points, dag_path):
+        self.restore_materials([key.rsplit("|", 1)[0] for key in stale_keys])
+        for key in stale_keys:
+            del self.highlighted_meshes[key]
+
+        mesh_faces = {}
+        for key in keys:
+            if key not in current_faces:
+                continue
+            face_indices = current_faces[key]
+            # インスタンスはシェイプ名が同じなので、DAGパスでインスタンスごとのコンポーネントを指定する
+            if key not in self.highlighted_meshes:
+                mesh_faces[key] = face_indices
+                self.highlighted_meshes[key] = face_indices
+        self.assign_red_material_batch(mesh_faces)
+        if not result.has_overlap:
+            self.text_editor.appendPlainText("No overlapping faces.")
+
+    # 複数メッシュのフェースに赤いマテリアルを一度にアサイン (キーはシェイプのDAGパス)
+    def assign_red_material_batch(self, mesh_faces):
+        # f[10:250] のように連続したフェースをまとめたコンポーネント名を作成
+        components = []
+        for mesh_name, face_indices in mesh_faces.items():
+            components.extend(component_names(mesh_name, face_indices))
+        if not components:
+            return
+        if not self.red_shading_group:
+            print("Error: shading group for redMaterial was not found.")
+            return
+        # マテリアルの割り当てでは形状は変わらないので、キャッシュの破棄と再判定をしない
+        cmds.undoInfo(openChunk=True, chunkName="assignOverlapMaterial")
         try:
-            for sample_point in sample_points:
-                is_collision = False
-                highlighted_faces = set()
-                for i in range(6):
-                    ray_direction = self.get_ray_direction(i)
-                    ray_origin = om2.MFloatPoint(sample_point.x, sample_point.y, sample_point.z)
-                    both_direction = False
-                    intersection_result = item_mesh_fn.allIntersections(
-                        ray_origin,
-                        ray_direction,
-                        om2.MSpace.kWorld,
-                        99999,
-                        both_direction
-                    )
-                    print(f"ray_origin: {ray_origin}")
-                    print(f"ray_direction: {ray_direction}")
-                    if intersection_result is not None:
-                        _, _, hit_faces, _, _, _ = intersection_result
-                        if hit_faces is not None and len(hit_faces) > 0:
-                            is_collision = True
-                            first_hit_face = hit_faces[0]
-                            if first_hit_face not in highlighted_faces:
-                                highlighted_faces.add(first_hit_face)
-                        else:
-                            pass
-                    else:
-                        pass
-
-                if is_collision:
-                    highlighted_faces_info = self.get_highlighted_faces_info(item_mesh_fn, highlighted_faces)
-                    self.infoeditor.update_info_editor(highlighted_faces_info)
-                    self.assign_red_material(item_mesh_fn, highlighted_faces)
-                else:
-                    self.infoeditor.update_info_editor([])
-
-        except RuntimeError as e:
-            print(f"サンプルポイントレイキャストでエラーが発生しました: {str(e)}")
-        except Exception as e:
-            print(f"予期しないエラーがサンプルポイントレイキャストで発生しました: {str(e)}")
-
-    # 赤いマテリアルをアサイン
-    def assign_red_material(self, item_mesh_fn, face_indices):
-        # 赤いマテリアルを適用
-        for face_index in face_indices:
-            cmds.select(cl=True)
-            vertex_indices = item_mesh_fn.getPolygonVertices(face_index)
-            face_name = f"{item_mesh_fn.name()}.f[{face_index}]"
-            cmds.select(face_name, add=True)
-            cmds.hyperShade(assign=self.red_material_name)
-            cmds.select(cl=True)
-            for vertex_index in vertex_indices:
-                cmds.select(f"{item_mesh_fn.name()}.vtx[{vertex_index}]", add=True)
+            with self.dirty_tracker.muted():
+                cmds.sets(components, edit=True, forceElement=self.red_shading_group)
+            cmds.select(components, replace=True)
             cmds.hilite(replace=True)
+        finally:
+            cmds.undoInfo(closeChunk=True)
 
 def get_maya_window():
     ptr = om.MQtUtil.mainWindow()
@@ -499,4 +858,5 @@ def launch_from_maya():
     window = MainWindow(parent=maya_window)
     window.show()
 
-launch_from_maya()
\ No newline at end of file
+if __name__ == "__main__":
+    launch_from_maya()
\ No newline at end of file
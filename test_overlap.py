@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+# python -m pytest -q test_overlap.py
+# BVHや判定の高速化した処理を、全ての組み合わせを調べる単純な実装の結果と比べる
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import numpy as np
+import pytest
+
+from overlap_benchmark import make_sphere
+from overlap_broadphase import sweep_and_prune
+from overlap_bvh import MeshBVH, WINDING_ACCURACY, triangulate_faces
+from overlap_engine import OverlapEngine
+from overlap_geometry import MeshArrays
+from overlap_highlight import component_names, compress_index_ranges
+from overlap_instance import InstancedBVH
+from overlap_narrowphase import (faces_within_distance, intersecting_faces, self_intersecting_faces,
+                                 triangle_pairs_distance, triangle_pairs_intersect)
+from overlap_pointset import VoxelPointSet, intersect_bounds
+from overlap_proxy import MeshProxy
+from overlap_voxel import SurfaceVoxels, cells_in_bounds, overlap_volume, refine_shared_voxels
+
+
+# 頂点を少しずらした球 (規則的な配置で境界上の交差ばかりにならないようにする)
+def noisy_sphere(rng, segments=16, radius=1.0, center=(0, 0, 0), noise=0.02):
+    points, face_counts, face_connects = make_sphere(segments, radius, center)
+    points = points + rng.uniform(-noise, noise, points.shape)
+    return MeshArrays(points, face_counts, face_connects)
+
+
+def build_bvh(mesh):
+    return MeshBVH.from_polygons(mesh.points, mesh.face_counts, mesh.face_connects)
+
+
+def random_rays(rng, count):
+    origins = rng.uniform(-1.5, 1.5, (count, 3))
+    directions = rng.normal(size=(count, 3))
+    return origins, directions / np.linalg.norm(directions, axis=1)[:, None]
+
+
+# 全てのレイと全ての三角形を Moller-Trumbore 法で判定し、(交差したか, レイパラメータ) を (レイ数, 三角形数) で返す
+def brute_force_hits(mesh, origins, directions, max_param=99999.0):
+    triangles, _ = triangulate_faces(mesh.face_counts, mesh.face_connects)
+    corners = mesh.points[triangles]
+    v0 = corners[None, :, 0]
+    e1 = corners[None, :, 1] - v0
+    e2 = corners[None, :, 2] - v0
+    directions = directions[:, None]
+    pvec = np.cross(directions, e2)
+    det = np.sum(e1 * pvec, axis=2)
+    tvec = origins[:, None] - v0
+    qvec = np.cross(tvec, e1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.sum(tvec * pvec, axis=2) / det
+        v = np.sum(directions * qvec, axis=2) / det
+        t = np.sum(e2 * qvec, axis=2) / det
+    hit = (np.abs(det) > 1e-12) & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t > 0.0) & (t <= max_param)
+    return hit, t
+
+
+def test_count_crossings_matches_brute_force():
+    rng = np.random.default_rng(1)
+    mesh = noisy_sphere(rng)
+    origins, directions = random_rays(rng, 500)
+    crossings = build_bvh(mesh).count_crossings(origins, directions)
+    np.testing.assert_array_equal(crossings, brute_force_hits(mesh, origins, directions)[0].sum(axis=1))
+
+
+def test_count_crossings_respects_max_param():
+    rng = np.random.default_rng(2)
+    mesh = noisy_sphere(rng)
+    origins, directions = random_rays(rng, 500)
+    crossings = build_bvh(mesh).count_crossings(origins, directions, max_param=0.5)
+    hit, _ = brute_force_hits(mesh, origins, directions, max_param=0.5)
+    np.testing.assert_array_equal(crossings, hit.sum(axis=1))
+
+
+# Sample モードのレイキャストで使う最初の交差も、全ての交差の中で最も近いものと一致する
+def test_first_hits_matches_brute_force():
+    rng = np.random.default_rng(3)
+    mesh = noisy_sphere(rng)
+    origins, directions = random_rays(rng, 500)
+    faces, params = build_bvh(mesh).first_hits(origins, directions)
+    hit, t = brute_force_hits(mesh, origins, directions)
+    t = np.where(hit, t, np.inf)
+    nearest = np.argmin(t, axis=1)
+    expected_params = t[np.arange(len(t)), nearest]
+    _, tri_faces = triangulate_faces(mesh.face_counts, mesh.face_connects)
+    expected_faces = np.where(np.isfinite(expected_params), tri_faces[nearest], -1)
+    assert np.isfinite(expected_params).any() and not np.isfinite(expected_params).all()
+    np.testing.assert_array_equal(faces, expected_faces)
+    np.testing.assert_allclose(params, expected_params)
+
+
+@pytest.mark.parametrize("tolerance", [0.0, 0.05])
+def test_sweep_and_prune_matches_all_pairs(tolerance):
+    rng = np.random.default_rng(4)
+    bounds_min = rng.uniform(0.0, 10.0, (200, 3))
+    bounds_max = bounds_min + rng.uniform(0.0, 1.5, (200, 3))
+    pairs, culled = sweep_and_prune(bounds_min, bounds_max, tolerance)
+    expected = [
+        (i, j)
+        for i in range(len(bounds_min)) for j in range(i + 1, len(bounds_min))
+        if np.all(bounds_min[i] - tolerance <= bounds_max[j] + tolerance)
+        and np.all(bounds_min[j] - tolerance <= bounds_max[i] + tolerance)
+    ]
+    assert expected
+    assert [tuple(pair) for pair in pairs.tolist()] == expected
+    assert culled == len(bounds_min) * (len(bounds_min) - 1) // 2 - len(expected)
+
+
+# 全ての三角形の組を判定して交差しているフェース番号を返す
+def brute_force_faces(mesh_a, mesh_b):
+    tris_a, faces_a = triangulate_faces(mesh_a.face_counts, mesh_a.face_connects)
+    tris_b, faces_b = triangulate_faces(mesh_b.face_counts, mesh_b.face_connects)
+    index_a, index_b = np.meshgrid(np.arange(len(tris_a)), np.arange(len(tris_b)), indexing='ij')
+    index_a = index_a.ravel()
+    index_b = index_b.ravel()
+    hit = triangle_pairs_intersect(mesh_a.points[tris_a[index_a]], mesh_b.points[tris_b[index_b]])
+    return np.unique(faces_a[index_a[hit]]), np.unique(faces_b[index_b[hit]])
+
+
+@pytest.mark.parametrize("offset", [0.5, 1.2, 1.9, 2.5])
+def test_intersecting_faces_matches_all_pairs(offset):
+    rng = np.random.default_rng(5)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12, radius=0.8, center=(offset, 0.1, 0.0))
+    faces_a, faces_b = intersecting_faces(build_bvh(mesh_a), build_bvh(mesh_b))
+    expected_a, expected_b = brute_force_faces(mesh_a, mesh_b)
+    np.testing.assert_array_equal(faces_a, expected_a)
+    np.testing.assert_array_equal(faces_b, expected_b)
+
+
+def test_compress_index_ranges_covers_indices():
+    rng = np.random.default_rng(6)
+    indices = rng.choice(200, 80, replace=False)
+    ranges = compress_index_ranges(np.concatenate([indices, indices[:10]]))
+    assert [index for start, end in ranges for index in range(start, end + 1)] == sorted(indices.tolist())
+    # 隣り合う番号は1つの範囲にまとめられている
+    assert all(start > end + 1 for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert compress_index_ranges([]) == []
+
+
+def test_component_names():
+    assert component_names("|rock|rockShape", [7, 3, 1, 2]) == ["|rock|rockShape.f[1:3]", "|rock|rockShape.f[7]"]
+
+
+def assert_same_pair_faces(result, expected):
+    assert sorted(result.pair_faces) == sorted(expected.pair_faces)
+    for pair, faces in expected.pair_faces.items():
+        np.testing.assert_array_equal(result.pair_faces[pair][0], faces[0])
+        np.testing.assert_array_equal(result.pair_faces[pair][1], faces[1])
+
+
+# 変更したメッシュを含むペアだけを再判定し、結果は全てを判定し直した場合と同じになる
+def test_search_incremental_rechecks_only_changed_pairs():
+    rng = np.random.default_rng(7)
+    keys = ["|a|aShape", "|b|bShape", "|c|cShape", "|d|dShape"]
+    meshes = [noisy_sphere(rng, center=(1.5 * index, 0.0, 0.0)) for index in range(len(keys))]
+    engine = OverlapEngine("Exact")
+    first = engine.search_incremental(keys, meshes)
+    assert first.evaluated_pairs == first.candidate_pairs == 3
+    assert_same_pair_faces(first, OverlapEngine("Exact").search(meshes))
+
+    moved = meshes[2]
+    meshes[2] = MeshArrays(moved.points + [0.2, 0.3, 0.0], moved.face_counts, moved.face_connects)
+    second = engine.search_incremental(keys, meshes, changed_keys={keys[2]})
+    assert (second.evaluated_pairs, second.reused_pairs) == (2, 1)
+    assert_same_pair_faces(second, OverlapEngine("Exact").search(meshes))
+
+    # 変更がなければ全てのペアで前回の結果を使う
+    third = engine.search_incremental(keys, meshes)
+    assert (third.evaluated_pairs, third.reused_pairs) == (0, 3)
+    assert_same_pair_faces(third, second)
+
+
+def test_invalidate_pairs_drops_only_changed_keys():
+    rng = np.random.default_rng(8)
+    keys = ["|a|aShape", "|b|bShape", "|c|cShape"]
+    meshes = [noisy_sphere(rng, center=(1.5 * index, 0.0, 0.0)) for index in range(len(keys))]
+    engine = OverlapEngine("Exact")
+    engine.search_incremental(keys, meshes)
+    engine.invalidate_pairs({keys[0]})
+    assert sorted(engine.pair_results) == [(keys[1], keys[2])]
+
+
+# 点をボクセルのキーの辞書に最初に追加された順に入れた結果と一致する
+def test_voxel_point_set_matches_dict():
+    rng = np.random.default_rng(9)
+    tolerance = 0.01
+    base = rng.uniform(-1.0, 1.0, (300, 3))
+    batches = [base[:200], base[100:] + rng.uniform(-0.5, 0.5, (200, 3)) * tolerance, base[::3]]
+    point_set = VoxelPointSet(tolerance)
+    expected = {}
+    for batch in batches:
+        point_set.add(batch)
+        for point in batch:
+            expected.setdefault(tuple(np.floor(point / tolerance).astype(np.int64)), point)
+        # 途中で参照しても、その後に追加した点と合わせて重複が取り除かれる
+        np.testing.assert_array_equal(point_set.points, np.array(list(expected.values())))
+    assert len(point_set) == len(expected) < sum(len(batch) for batch in batches)
+
+
+# 全ての三角形の立体角を足し合わせた巻き数 (遠方近似を使わない)
+def brute_force_winding(mesh, points):
+    triangles, _ = triangulate_faces(mesh.face_counts, mesh.face_connects)
+    corners = mesh.points[triangles]
+    a = corners[None, :, 0] - points[:, None]
+    b = corners[None, :, 1] - points[:, None]
+    c = corners[None, :, 2] - points[:, None]
+    len_a = np.linalg.norm(a, axis=2)
+    len_b = np.linalg.norm(b, axis=2)
+    len_c = np.linalg.norm(c, axis=2)
+    numerator = np.sum(a * np.cross(b, c), axis=2)
+    denominator = (len_a * len_b * len_c + np.sum(a * b, axis=2) * len_c
+                   + np.sum(b * c, axis=2) * len_a + np.sum(c * a, axis=2) * len_b)
+    return np.arctan2(numerator, denominator).sum(axis=1) / (2.0 * np.pi)
+
+
+def test_winding_numbers_match_brute_force():
+    rng = np.random.default_rng(10)
+    mesh = noisy_sphere(rng)
+    points = rng.uniform(-1.5, 1.5, (400, 3))
+    expected = brute_force_winding(mesh, points)
+    bvh = build_bvh(mesh)
+    # 遠方近似を使わなければ一致する
+    np.testing.assert_allclose(bvh.winding_numbers(points, accuracy=np.inf), expected, atol=1e-9)
+    # 遠方近似を使っても誤差は内外を分ける 0.5 より十分小さく、内外の判定は変わらない
+    approximate = bvh.winding_numbers(points, WINDING_ACCURACY)
+    np.testing.assert_allclose(approximate, expected, atol=0.05)
+    np.testing.assert_array_equal(np.abs(approximate) > 0.5, np.abs(expected) > 0.5)
+    # 閉じたメッシュではレイの交差回数の偶奇と同じ判定になる
+    assert 0 < (np.abs(expected) > 0.5).sum() < len(points)
+    crossings = bvh.count_crossings(points, np.tile([0.0, 0.0, 1.0], (len(points), 1)))
+    np.testing.assert_array_equal(np.abs(expected) > 0.5, crossings % 2 != 0)
+
+
+# 同じボクセルに表面がある三角形の組だけを判定しても、全ての組を判定した結果と同じフェースになる
+@pytest.mark.parametrize("voxel_size", [0.03, 0.1, 0.4])
+def test_refine_shared_voxels_matches_all_pairs(voxel_size):
+    rng = np.random.default_rng(11)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12, radius=0.8, center=(1.2, 0.1, 0.0))
+    bvh_a = build_bvh(mesh_a)
+    bvh_b = build_bvh(mesh_b)
+    bounds = intersect_bounds(bvh_a.bounds, bvh_b.bounds)
+    faces_a, faces_b = refine_shared_voxels(
+        bvh_a, bvh_b, SurfaceVoxels(bvh_a, voxel_size, bounds), SurfaceVoxels(bvh_b, voxel_size, bounds))
+    expected_a, expected_b = brute_force_faces(mesh_a, mesh_b)
+    np.testing.assert_array_equal(faces_a, expected_a)
+    np.testing.assert_array_equal(faces_b, expected_b)
+
+
+# 両方のメッシュの内部にあるセルの中心を、全ての三角形とのレイの交差回数で数えた体積と一致する
+def test_overlap_volume_matches_brute_force():
+    rng = np.random.default_rng(12)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12, radius=0.8, center=(1.2, 0.1, 0.0))
+    voxel_size = 0.05
+    volume = overlap_volume(build_bvh(mesh_a), build_bvh(mesh_b), voxel_size)
+    bounds = intersect_bounds(mesh_a.bounds, mesh_b.bounds)
+    centers = (cells_in_bounds(bounds[0], bounds[1], voxel_size) + 0.5) * voxel_size
+    up = np.tile([0.0, 0.0, 1.0], (len(centers), 1))
+    inside_a = brute_force_hits(mesh_a, centers, up)[0].sum(axis=1) % 2 != 0
+    inside_b = brute_force_hits(mesh_b, centers, up)[0].sum(axis=1) % 2 != 0
+    expected = np.count_nonzero(inside_a & inside_b) * voxel_size ** 3
+    assert expected > 0.0
+    assert volume == pytest.approx(expected)
+
+
+# 全ての三角形の組 (頂点を共有する組を除く) を判定した結果と同じフェースになる
+def test_self_intersecting_faces_matches_all_pairs():
+    rng = np.random.default_rng(13)
+    sphere_a = noisy_sphere(rng)
+    sphere_b = noisy_sphere(rng, segments=12, radius=0.8, center=(1.2, 0.1, 0.0))
+    # 重なった2つの球を1つのメッシュにまとめる
+    mesh = MeshArrays(np.concatenate([sphere_a.points, sphere_b.points]),
+                      np.concatenate([sphere_a.face_counts, sphere_b.face_counts]),
+                      np.concatenate([sphere_a.face_connects, sphere_b.face_connects + len(sphere_a.points)]))
+    triangles, tri_faces = triangulate_faces(mesh.face_counts, mesh.face_connects)
+    first, second = np.triu_indices(len(triangles), 1)
+    shared = np.any(triangles[first][:, :, None] == triangles[second][:, None, :], axis=(1, 2))
+    first, second = first[~shared], second[~shared]
+    hit = triangle_pairs_intersect(mesh.points[triangles[first]], mesh.points[triangles[second]])
+    expected = np.unique(tri_faces[np.concatenate([first[hit], second[hit]])])
+    assert len(expected)
+    np.testing.assert_array_equal(self_intersecting_faces(build_bvh(mesh)), expected)
+    # 1つの球だけなら自己交差はない
+    assert not len(self_intersecting_faces(build_bvh(sphere_a)))
+
+
+# 三角形の上に格子状に点を置く (1辺を divisions 等分)
+def triangle_samples(triangle, divisions):
+    i, j = np.meshgrid(np.arange(divisions + 1), np.arange(divisions + 1), indexing='ij')
+    inside = i + j <= divisions
+    u = i[inside][:, None] / divisions
+    v = j[inside][:, None] / divisions
+    return triangle[0] + u * (triangle[1] - triangle[0]) + v * (triangle[2] - triangle[0])
+
+
+def test_triangle_pairs_distance_matches_sampling():
+    rng = np.random.default_rng(9)
+    divisions = 40
+    tris_a = rng.uniform(-1.0, 1.0, (20, 3, 3))
+    tris_b = rng.uniform(-1.0, 1.0, (20, 3, 3)) + rng.uniform(-1.5, 1.5, (20, 1, 3))
+    distance = triangle_pairs_distance(tris_a, tris_b)
+    for triangle_a, triangle_b, value in zip(tris_a, tris_b, distance):
+        samples_a = triangle_samples(triangle_a, divisions)
+        samples_b = triangle_samples(triangle_b, divisions)
+        sampled = np.linalg.norm(samples_a[:, None] - samples_b[None], axis=2).min()
+        # 格子点は三角形上の点なので最短距離より短くならず、格子の間隔より大きくは離れない
+        spacing = max(np.linalg.norm(triangle - np.roll(triangle, 1, axis=0), axis=1).max()
+                      for triangle in (triangle_a, triangle_b)) / divisions
+        assert value <= sampled + 1e-9
+        assert sampled - value <= 2.0 * spacing
+    # 交差している三角形の距離は0になる
+    hit = triangle_pairs_intersect(tris_a, tris_b)
+    assert hit.any()
+    np.testing.assert_allclose(distance[hit], 0.0, atol=1e-9)
+
+
+# 全ての三角形の組の距離から求めたフェースごとの最短距離と一致する
+def test_faces_within_distance_matches_all_pairs():
+    rng = np.random.default_rng(15)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12, radius=0.8, center=(1.9, 0.1, 0.0))
+    clearance = 0.2
+    tris_a, faces_a = triangulate_faces(mesh_a.face_counts, mesh_a.face_connects)
+    tris_b, faces_b = triangulate_faces(mesh_b.face_counts, mesh_b.face_connects)
+    index_a, index_b = np.meshgrid(np.arange(len(tris_a)), np.arange(len(tris_b)), indexing='ij')
+    distance = triangle_pairs_distance(mesh_a.points[tris_a[index_a.ravel()]], mesh_b.points[tris_b[index_b.ravel()]])
+    distance = distance.reshape(index_a.shape)
+    result = faces_within_distance(build_bvh(mesh_a), build_bvh(mesh_b), clearance)
+    for tri_faces, tri_distance, found_faces, found_distance in (
+            (faces_a, distance.min(axis=1), result[0], result[1]),
+            (faces_b, distance.min(axis=0), result[2], result[3])):
+        near = tri_distance <= clearance
+        expected_faces = np.unique(tri_faces[near])
+        expected_distance = [tri_distance[tri_faces == face].min() for face in expected_faces]
+        assert len(expected_faces)
+        np.testing.assert_array_equal(found_faces, expected_faces)
+        np.testing.assert_allclose(found_distance, expected_distance)
+
+
+def test_refit_matches_rebuild():
+    rng = np.random.default_rng(16)
+    mesh = noisy_sphere(rng)
+    other = noisy_sphere(rng, segments=12, radius=0.8, center=(1.3, 0.0, 0.0))
+    bvh = build_bvh(mesh)
+    # 大きく変形させて、元のBVHの分割が合わなくなった状態でも結果が変わらないことを確認する
+    deformed = mesh.points * [1.8, 0.6, 1.0] + rng.uniform(-0.1, 0.1, mesh.points.shape)
+    bvh.refit(deformed)
+    rebuilt = MeshBVH.from_polygons(deformed, mesh.face_counts, mesh.face_connects)
+    origins, directions = random_rays(rng, 500)
+    np.testing.assert_array_equal(
+        bvh.count_crossings(origins, directions), rebuilt.count_crossings(origins, directions))
+    other_bvh = build_bvh(other)
+    refit_faces = intersecting_faces(bvh, other_bvh)
+    rebuilt_faces = intersecting_faces(rebuilt, other_bvh)
+    assert len(refit_faces[0])
+    np.testing.assert_array_equal(refit_faces[0], rebuilt_faces[0])
+    np.testing.assert_array_equal(refit_faces[1], rebuilt_faces[1])
+
+
+def test_refit_rejects_different_point_count():
+    rng = np.random.default_rng(17)
+    mesh = noisy_sphere(rng)
+    with pytest.raises(ValueError):
+        build_bvh(mesh).refit(mesh.points[:-1])
+
+
+# 頂点数が同じでもフェース構成が変わったフレームは、そのフレームのフェース番号で結果を返す
+def test_scan_frames_rebuilds_on_new_face_layout():
+    rng = np.random.default_rng(19)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12, radius=0.8, center=(1.2, 0.1, 0.0))
+    # フェースの並びを逆にしたメッシュ (頂点は同じ)
+    order = np.arange(mesh_a.num_faces)[::-1]
+    connects = np.concatenate([mesh_a.face_vertices(face) for face in order])
+    remeshed = MeshArrays(mesh_a.points, mesh_a.face_counts[order], connects)
+    frames = [(0, [mesh_a.points, mesh_b.points]), (1, [remeshed, mesh_b.points])]
+    timeline = OverlapEngine("Exact").scan_frames([mesh_a, mesh_b], frames)
+    for frame, mesh in ((0, mesh_a), (1, remeshed)):
+        expected = intersecting_faces(build_bvh(mesh), build_bvh(mesh_b))
+        faces = timeline.frame_pairs[frame][(0, 1)]
+        np.testing.assert_array_equal(faces[0], expected[0])
+        np.testing.assert_array_equal(faces[1], expected[1])
+    assert timeline.profile.counters["rebuilds"] == 1
+
+
+# インスタンスはオブジェクト空間で判定するが、ワールド空間の頂点で判定した結果と同じになる
+def test_instanced_bvh_matches_world_space():
+    rng = np.random.default_rng(18)
+    mesh_a = noisy_sphere(rng)
+    mesh_b = noisy_sphere(rng, segments=12)
+    angle = 0.7
+    matrix = np.identity(4)
+    matrix[:3, :3] = np.array([
+        [np.cos(angle), np.sin(angle), 0.0],
+        [-np.sin(angle), np.cos(angle), 0.0],
+        [0.0, 0.0, 1.0],
+    ]) * 1.3
+    matrix[3, :3] = (1.4, 0.2, -0.1)
+    world_points = np.dot(mesh_b.points, matrix[:3, :3]) + matrix[3, :3]
+    world_b = MeshArrays(world_points, mesh_b.face_counts, mesh_b.face_connects)
+    instanced = intersecting_faces(build_bvh(mesh_a), InstancedBVH(build_bvh(mesh_b), matrix))
+    expected = brute_force_faces(mesh_a, world_b)
+    assert len(expected[0])
+    np.testing.assert_array_equal(instanced[0], expected[0])
+    np.testing.assert_array_equal(instanced[1], expected[1])
+
+
+# X軸方向の細長い円柱 (両端はn角形のフェースでふさぐ)
+def make_pole(segments, length, radius):
+    angles = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    ring = np.stack([np.zeros(segments), radius * np.cos(angles), radius * np.sin(angles)], axis=1)
+    points = np.concatenate([ring - [length / 2, 0, 0], ring + [length / 2, 0, 0]])
+    counts, connects = [], []
+    for k in range(segments):
+        counts.append(4)
+        connects += [k, (k + 1) % segments, segments + (k + 1) % segments, segments + k]
+    counts += [segments, segments]
+    connects += list(range(segments))[::-1] + list(range(segments, 2 * segments))
+    return MeshArrays(points, counts, connects)
+
+
+# 細長いメッシュは代理メッシュで線分につぶれるが、粗い判定で見落とさずに Exact と同じフェースを返す
+@pytest.mark.parametrize("resolution", [1, 2, 16])
+def test_progressive_keeps_thin_pole(resolution, monkeypatch):
+    monkeypatch.setattr("overlap_engine.MeshProxy", lambda mesh: MeshProxy(mesh, resolution))
+    pole = make_pole(38, 40.0, 0.4)
+    sphere = MeshArrays(*make_sphere(24))
+    exact = OverlapEngine("Exact").search([pole, sphere])
+    progressive = OverlapEngine("Progressive").search([pole, sphere])
+    assert progressive.coarse_pairs == [(0, 1)]
+    assert sorted(progressive.pair_faces) == sorted(exact.pair_faces) == [(0, 1)]
+    for faces, expected in zip(progressive.pair_faces[(0, 1)], exact.pair_faces[(0, 1)]):
+        np.testing.assert_array_equal(faces, expected)